@@ -39,4 +39,8 @@ app.register_blueprint(students_bp, url_prefix='/student')
 from app.communities import bp as communities_bp
 app.register_blueprint(communities_bp, url_prefix='/communities')
 
-from app import models
+from app.api import bp as api_bp
+app.register_blueprint(api_bp, url_prefix='/api/v1')
+
+from app import models, cli, profiler
+cli.register(app)
@@ -0,0 +1,87 @@
+from flask_login import current_user
+from app import db
+from app.models import (Mentor, Group, Student, Discipline, Theme, DisciplinePointRecord,
+                        group_mentors, group_students)
+from app.constants import Access
+
+# Права доступа в виде условий запроса: вместо загрузки связей и проверки
+# в Python к запросу добавляется EXISTS по индексированным ключам.
+#   Наставник - свои группы и их студенты, записи по своему предмету
+#   Главный наставник - группы своего предмета и их студенты
+#   Ястреб - без записей за учебу
+#   Ангел и администраторы - все
+
+
+class Scope:
+    def __init__(self, user):
+        self.user = user
+        self.level = user.access_level
+
+    def nothing(self, query):
+        return query.filter(db.false())
+
+    def groups(self, query=None):
+        if query is None:
+            query = Group.query
+        if self.level == Access.MENTOR:
+            return query.filter(db.exists().where(db.and_(
+                group_mentors.c.group_id == Group.id,
+                group_mentors.c.mentor_id == self.user.id)).correlate(Group))
+        if self.level == Access.UP_MENTOR:
+            return query.filter(Group.discipline_id == self.user.discipline_id)
+        return query
+
+    def students(self, query=None):
+        if query is None:
+            query = Student.query
+        if self.level == Access.MENTOR:
+            return query.filter(db.exists().where(db.and_(
+                group_students.c.student_id == Student.id,
+                group_mentors.c.group_id == group_students.c.group_id,
+                group_mentors.c.mentor_id == self.user.id)).correlate(Student))
+        if self.level == Access.UP_MENTOR:
+            return query.filter(db.exists().where(db.and_(
+                group_students.c.student_id == Student.id,
+                Group.id == group_students.c.group_id,
+                Group.discipline_id == self.user.discipline_id)).correlate(Student))
+        return query
+
+    def disciplines(self, query=None):
+        if query is None:
+            query = Discipline.query
+        if self.level in [Access.MENTOR, Access.UP_MENTOR]:
+            return query.filter(Discipline.id == self.user.discipline_id)
+        return query
+
+    def themes(self, query=None):
+        if query is None:
+            query = Theme.query
+        if self.level in [Access.MENTOR, Access.UP_MENTOR]:
+            return query.filter(Theme.discipline_id == self.user.discipline_id)
+        return query
+
+    def discipline_records(self, query=None):
+        if query is None:
+            query = DisciplinePointRecord.query
+        if self.level == Access.HAWK:
+            return self.nothing(query)
+        if self.level in [Access.MENTOR, Access.UP_MENTOR]:
+            return query.filter(db.exists().where(db.and_(
+                Theme.id == DisciplinePointRecord.theme_id,
+                Theme.discipline_id == self.user.discipline_id)).correlate(DisciplinePointRecord))
+        return query
+
+    def mentors(self, query=None):
+        if query is None:
+            query = Mentor.query
+        # Менторов своего уровня и выше не видно, администраторов добавляет только главный
+        query = query.filter(Mentor.access_level < self.level)
+        if self.level == Access.UP_MENTOR:
+            return query.filter(Mentor.discipline_id == self.user.discipline_id)
+        if self.level < Access.ADMIN:
+            return self.nothing(query)
+        return query
+
+
+def scope():
+    return Scope(current_user)
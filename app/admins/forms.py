@@ -3,7 +3,9 @@ from flask import flash
 from wtforms import StringField, PasswordField, SubmitField, SelectField
 from wtforms.validators import ValidationError, DataRequired, EqualTo
 from app.constants import Access, access_desc
-from app.models import Mentor, Discipline, Group
+from app import choices
+from app.choices import TypeaheadField
+from app.models import Mentor, Group
 
 
 class MentorForm(FlaskForm):
@@ -25,8 +27,7 @@ class MentorForm(FlaskForm):
             current_user.access_level if current_user else 0,
                                             access_desc.items()))
 
-        self.disciplines.choices = [(t.id, t.name)
-                                    for t in Discipline.query.order_by(Discipline.name).all()]
+        self.disciplines.choices = choices.disciplines()
         if current_user and\
                 current_user.access_level == Access.UP_MENTOR:
             self.disciplines.choices = [(current_user.discipline_id, current_user.discipline.name)]
@@ -89,19 +90,17 @@ class ChangeSelfForm(FlaskForm):
 
 
 class GroupMentorForm(FlaskForm):
-    groups = SelectField('Группа', validators=[DataRequired()], coerce=int)
+    groups = TypeaheadField('Группа', validators=[DataRequired()], endpoint='main.typeahead_groups')
     submit = SubmitField('Добавить')
 
     def __init__(self, user, *args, **kwargs):
         super(GroupMentorForm, self).__init__(*args, **kwargs)
-        group_ids = user.groups.with_entities(Group.id)
-        self.groups.choices = [(t.id, t.name) for t in
-                               Group.query.filter(
-                                   Group.id.notin_(group_ids),
-                                   Group.discipline_id == user.discipline_id
-                               ).all()]
+        self._user = user
+        self.groups.params = dict(mentor_id=user.id, discipline_id=user.discipline_id)
 
     def validate_groups(self, groups):
         group = Group.query.filter_by(id=groups.data).first()
-        if group is None:
-            raise ValidationError('Нет такой группы')
\ No newline at end of file
+        if group is None or group.discipline_id != self._user.discipline_id:
+            raise ValidationError('Нет такой группы')
+        if self._user.is_in_group(group):
+            raise ValidationError('Наставник уже в этой группе')
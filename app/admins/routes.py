@@ -1,11 +1,17 @@
 from flask import render_template, flash, redirect, url_for, request, g
 from flask_login import current_user, login_required
 from app import app, db
-from app.models import Mentor, Group
+from app.models import Mentor, Group, forget_mentor, identities
 from app.admins import bp
 from app.admins.forms import MentorForm, ChangeMentorForm, GroupMentorForm, ChangeSelfForm
 from app.constants import Access
 from app.utils import get_mentor, admin_required
+from app.pagination import paginate
+from app.access import scope
+from app.profiler import history
+from app.fragments import fragments
+from app.pagination import counts
+from app.communities.events import recent_events
 
 
 @bp.route('/', methods=['GET', 'POST'])
@@ -16,7 +22,6 @@ def index():
             current_user.access_level < 5:
         return redirect(url_for('main.index'))
     form = MentorForm(current_user)
-    page = request.args.get('page', 1, type=int)
 
     if form.validate_on_submit():
         # noinspection PyArgumentList
@@ -31,21 +36,15 @@ def index():
         db.session.add(new_mentor)
         db.session.commit()
         flash('%s %s добавлен' % (new_mentor.access, new_mentor.username))
-        return redirect(url_for('admins.index', page=page))
-
-    data = Mentor.query.filter(
-        # Администраторов может добавлять только главный администратор
-        Mentor.access_level < current_user.access_level
-    )
-
-    if current_user.access_level == Access.UP_MENTOR:
-        data = data.filter(Mentor.discipline_id == current_user.discipline_id)
-
-    data = data.order_by(
-        Mentor.access_level.desc(), Mentor.last_name, Mentor.first_name, Mentor.username
-    ).paginate(
-        page, app.config['MENTORS_PER_PAGE'], False
-    )
+        return redirect(url_for('admins.index'))
+
+    # Имя и фамилия у старых записей могут быть пустыми
+    data = paginate(scope().mentors(), [(Mentor.access_level, True),
+                                        (db.func.coalesce(Mentor.last_name, ''), False),
+                                        (db.func.coalesce(Mentor.first_name, ''), False),
+                                        (Mentor.username, False),
+                                        (Mentor.id, False)],
+                    app.config['MENTORS_PER_PAGE'])
     g.url_for = 'admins.index'
 
     return render_template('data_list.html', form=form,
@@ -102,6 +101,7 @@ def mentor(username):
                 user.discipline_id = form.disciplines.data
 
         db.session.commit()
+        forget_mentor(user.id)
         flash('%s %s Изменен' % (user.access, user.username))
         return redirect(url_for('admins.mentor', username=user.username))
 
@@ -126,5 +126,18 @@ def remove_mentor(username):
     if user.id != current_user.id and current_user.access_level > user.access_level:
         db.session.delete(user)
         db.session.commit()
+        forget_mentor(user.id)
 
     return redirect(url_for('admins.index'))
+
+
+@bp.route('/debug/sql')
+@admin_required
+def sql_stats():
+    caches = [('Карточки и строки таблиц', fragments.stats()),
+              ('Вошедшие менторы', identities.stats()),
+              ('Число записей в списках', counts.stats()),
+              ('События сообществ', recent_events.stats())]
+
+    return render_template('admins/sql_stats.html', title='Запросы к базе',
+                           history=list(history), caches=caches)
@@ -0,0 +1,101 @@
+import json
+import re
+from flask import has_request_context, request
+from sqlalchemy import event
+from app import app, db
+
+# Поиск запросов без подходящего индекса: запоминаем SELECT'ы по страницам и
+# смотрим их план (EXPLAIN QUERY PLAN в SQLite, EXPLAIN в Postgres).
+# Включается SQL_ADVISOR=1 или командой flask sql advise
+
+
+class QueryAdvisor:
+    def __init__(self):
+        self.enabled = False
+        self.installed = False
+        # страница -> {запрос: параметры}
+        self.statements = {}
+        self.plans = {}
+
+    def enable(self):
+        if not self.installed:
+            event.listen(db.get_engine(app), 'before_cursor_execute', self.record)
+            self.installed = True
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        self.statements.clear()
+        self.plans.clear()
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        if not self.enabled or executemany or not statement.lstrip().upper().startswith('SELECT'):
+            return
+        endpoint = request.endpoint if has_request_context() else None
+        self.statements.setdefault(endpoint or '-', {}).setdefault(statement, parameters)
+
+    def full_scans(self, statement, parameters):
+        if statement not in self.plans:
+            engine = db.get_engine(app)
+            explain = explains.get(engine.dialect.name)
+            if explain is None:
+                return []
+            connection = engine.raw_connection()
+            try:
+                self.plans[statement] = explain(connection, statement, parameters)
+            finally:
+                connection.close()
+        return self.plans[statement]
+
+    def report(self):
+        # {страница: [(таблицы, запрос)]}, только запросы с полным просмотром
+        result = {}
+        for endpoint, statements in sorted(self.statements.items()):
+            for statement, parameters in statements.items():
+                tables = self.full_scans(statement, parameters)
+                if tables:
+                    result.setdefault(endpoint, []).append((tables, statement))
+        return result
+
+
+def explain_sqlite(connection, statement, parameters):
+    cursor = connection.cursor()
+    cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+    tables = []
+    for row in cursor.fetchall():
+        # SCAN student - полный просмотр, SCAN ... USING INDEX - обход индекса
+        match = re.match(r'SCAN (?:TABLE )?(\S+)', row[-1])
+        if match and 'USING' not in row[-1]:
+            tables.append(match.group(1))
+    cursor.close()
+    return tables
+
+
+def explain_postgres(connection, statement, parameters):
+    cursor = connection.cursor()
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+    plan = cursor.fetchone()[0]
+    cursor.close()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    tables = []
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if node['Node Type'] == 'Seq Scan':
+            tables.append(node['Relation Name'])
+        nodes += node.get('Plans', [])
+    return tables
+
+
+explains = {
+    'sqlite': explain_sqlite,
+    'postgresql': explain_postgres
+}
+
+advisor = QueryAdvisor()
+if app.config['SQL_ADVISOR']:
+    advisor.enable()
@@ -0,0 +1,60 @@
+import hashlib
+from functools import wraps
+from flask import abort
+from flask_login import current_user
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from app import app, login
+from app.models import Mentor, mentor_user
+
+# Интеграции входят по токену: Authorization: Bearer <токен из flask api token>.
+# В токене id ментора и отпечаток хэша пароля - смена пароля отзывает токены
+
+
+def serializer():
+    return URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='api')
+
+
+def fingerprint(mentor):
+    return hashlib.sha256((mentor.password_hash or '').encode()).hexdigest()[:16]
+
+
+def make_token(mentor):
+    return serializer().dumps([mentor.id, fingerprint(mentor)])
+
+
+@login.request_loader
+def load_token(request):
+    # Токен только для чтения через API, страницы сайта его не принимают
+    header = request.headers.get('Authorization', '')
+    if request.blueprint != 'api' or not header.startswith('Bearer '):
+        return None
+    try:
+        mentor_id, stamp = serializer().loads(header[len('Bearer '):].strip(),
+                                              max_age=app.config['API_TOKEN_MAX_AGE'])
+    except (BadSignature, ValueError, TypeError):
+        return None
+
+    mentor = Mentor.query.get(mentor_id)
+    if mentor is None or fingerprint(mentor) != stamp:
+        return None
+    return mentor_user(mentor.id)
+
+
+def api_login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_user.is_authenticated:
+            abort(401, 'Нужен вход или токен API')
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def level_required(level):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if current_user.access_level < level:
+                abort(403, 'Недостаточно прав')
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
@@ -0,0 +1,26 @@
+from flask import jsonify, request
+from werkzeug.exceptions import HTTPException
+from app.api import bp
+
+
+def is_api_request():
+    # Неизвестные адреса и 500 обрабатывает приложение, blueprint там не определен
+    return request.path.startswith('/api/')
+
+
+# Ошибки API - JSON, а не перенаправление на главную, как у страниц.
+# Коды перечислены явно: обработчик 404 приложения иначе важнее общего обработчика.
+# 404 и 500 вне view API - в app/errors/handlers.py
+@bp.errorhandler(HTTPException)
+@bp.errorhandler(400)
+@bp.errorhandler(401)
+@bp.errorhandler(403)
+@bp.errorhandler(404)
+def http_error(error):
+    return json_error(error.description, error.code)
+
+
+def json_error(message, code):
+    response = jsonify(error=message)
+    response.status_code = code
+    return response
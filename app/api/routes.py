@@ -0,0 +1,268 @@
+import hashlib
+from datetime import datetime
+from flask import request, jsonify, abort, Response
+from flask_login import current_user
+from app import app, db
+from app.api import bp
+from app.api.auth import api_login_required, level_required
+from app.access import scope
+from app.constants import Access, Orders
+from app.ledger import entries
+from app.models import Student, Group, Order, OrderRecord, group_students, group_mentors
+from app.pagination import paginate
+
+# Только чтение. Списки - страницами по курсору (?cursor=, ?limit=), пачкой -
+# ?ids=1,2,3, поля - ?fields=id,balance. ETag собирается из version записей
+# (и балансов), поэтому на совпавший If-None-Match ответ даже не сериализуется.
+
+
+def id_list(name='ids'):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        ids = [int(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        abort(400, '%s - числа через запятую' % name)
+    if len(ids) > app.config['API_BATCH_SIZE']:
+        abort(400, 'Не больше %i id за запрос' % app.config['API_BATCH_SIZE'])
+    return list(dict.fromkeys(ids))
+
+
+def field_list(available, default):
+    value = request.args.get('fields')
+    if not value:
+        return default
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        abort(400, 'Неизвестные поля: %s' % ', '.join(unknown))
+    return fields
+
+
+def limit():
+    return max(1, min(request.args.get('limit', app.config['API_PER_PAGE'], type=int),
+                      app.config['API_BATCH_SIZE']))
+
+
+def page_or_batch(query, keys, ids, id_column):
+    # Пачка по id (и список не найденных или недоступных) либо страница по курсору
+    if ids is not None:
+        items = query.filter(id_column.in_(ids)).all() if ids else []
+        return items, dict(missing=sorted(set(ids) - {item.id for item in items}))
+    page = paginate(query, keys, limit(), count=False)
+    return page.items, dict(next=page.next_cursor)
+
+
+def conditional(versions, build):
+    # ETag по версиям записей и правам пользователя, тело строим только при несовпадении
+    etag = hashlib.md5(repr((request.full_path, current_user.id, current_user.access_level,
+                             versions)).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Cookie, Authorization'
+    return response
+
+
+def timestamp(value):
+    return value.isoformat() if value else None
+
+
+# Студенты
+
+student_fields = ['id', 'version', 'first_name', 'last_name', 'vk_id', 'balance', 'groups']
+
+
+def student_groups(student_ids):
+    # {student_id: [group_id]} одним запросом, только видимые группы
+    groups = {}
+    if student_ids:
+        for student_id, group_id in scope().groups(db.session.query(
+                group_students.c.student_id, Group.id
+        ).join(group_students, group_students.c.group_id == Group.id)).filter(
+                group_students.c.student_id.in_(student_ids)).order_by(Group.id):
+            groups.setdefault(student_id, []).append(group_id)
+    return groups
+
+
+def student_response(students, fields, extra):
+    ids = [student.id for student in students]
+    balances = Student.balances(ids) if 'balance' in fields else {}
+    groups = student_groups(ids) if 'groups' in fields else {}
+
+    versions = [(student.id, student.version, balances.get(student.id), groups.get(student.id))
+                for student in students]
+
+    def item(student):
+        result = {}
+        for field in fields:
+            if field == 'balance':
+                result[field] = balances[student.id]._asdict()
+            elif field == 'groups':
+                result[field] = groups.get(student.id, [])
+            else:
+                result[field] = getattr(student, field)
+        return result
+
+    return conditional((versions, extra), lambda: dict(data=[item(student) for student in students],
+                                                       **extra))
+
+
+@bp.route('/students')
+@api_login_required
+def students():
+    fields = field_list(student_fields, student_fields)
+    items, extra = page_or_batch(scope().students(), [(Student.last_name, False),
+                                                      (Student.first_name, False),
+                                                      (Student.id, False)],
+                                 id_list(), Student.id)
+    return student_response(items, fields, extra)
+
+
+@bp.route('/students/<int:student_id>')
+@api_login_required
+def student(student_id):
+    fields = field_list(student_fields, student_fields)
+    found = scope().students().filter(Student.id == student_id).first()
+    if found is None:
+        abort(404, 'Студент не найден')
+    return student_response([found], fields, {})
+
+
+@bp.route('/students/<int:student_id>/ledger')
+@api_login_required
+def student_ledger(student_id):
+    if scope().students().filter(Student.id == student_id).first() is None:
+        abort(404, 'Студент не найден')
+
+    rows = entries(student_id)
+    query = db.session.query(rows.c.kind, rows.c.id, rows.c.version, rows.c.timestamp,
+                             rows.c.description, rows.c.amount, rows.c.mentor, rows.c.commentary)
+    # У старых записей времени нет - они считаются самыми ранними
+    time_key = db.func.coalesce(rows.c.timestamp, datetime(1970, 1, 1))
+    page = paginate(query, [(time_key, False), (rows.c.kind, False), (rows.c.id, False)],
+                    limit(), count=False)
+
+    # Описание и ментор берутся из тем, предметов и менторов, их версий в строке нет -
+    # поэтому ETag по строкам целиком
+    return conditional(([tuple(row) for row in page.items], page.next_cursor), lambda: dict(data=[
+        dict(kind=kind, id=id, version=version, timestamp=timestamp(moment),
+             description=description, amount=amount, mentor=mentor, commentary=commentary)
+        for kind, id, version, moment, description, amount, mentor, commentary in page.items
+    ], next=page.next_cursor))
+
+
+# Группы
+
+group_fields = ['id', 'version', 'name', 'discipline_id', 'discipline', 'students', 'mentors']
+
+
+def rosters(group_ids):
+    # {group_id: [(id, version, first_name, last_name)]} одним запросом
+    result = {}
+    if group_ids:
+        for group_id, *student in db.session.query(
+                group_students.c.group_id, Student.id, Student.version,
+                Student.first_name, Student.last_name
+        ).join(Student, Student.id == group_students.c.student_id).filter(
+                group_students.c.group_id.in_(group_ids)
+        ).order_by(Student.last_name, Student.first_name, Student.id):
+            result.setdefault(group_id, []).append(tuple(student))
+    return result
+
+
+def group_response(groups, fields, extra):
+    ids = [group.id for group in groups]
+    students = rosters(ids) if 'students' in fields else {}
+    mentors = {}
+    if 'mentors' in fields and ids:
+        for group_id, mentor_id in db.session.query(
+                group_mentors.c.group_id, group_mentors.c.mentor_id
+        ).filter(group_mentors.c.group_id.in_(ids)).order_by(group_mentors.c.mentor_id):
+            mentors.setdefault(group_id, []).append(mentor_id)
+
+    versions = [(group.id, group.version,
+                 group.discipline.version if 'discipline' in fields and group.discipline else None,
+                 students.get(group.id), mentors.get(group.id)) for group in groups]
+
+    def item(group):
+        result = {}
+        for field in fields:
+            if field == 'discipline':
+                result[field] = group.discipline.name if group.discipline else None
+            elif field == 'students':
+                result[field] = [dict(id=id, first_name=first_name, last_name=last_name)
+                                 for id, _, first_name, last_name in students.get(group.id, [])]
+            elif field == 'mentors':
+                result[field] = mentors.get(group.id, [])
+            else:
+                result[field] = getattr(group, field)
+        return result
+
+    return conditional((versions, extra), lambda: dict(data=[item(group) for group in groups],
+                                                       **extra))
+
+
+@bp.route('/groups')
+@api_login_required
+def groups():
+    fields = field_list(group_fields, group_fields)
+    items, extra = page_or_batch(scope().groups().options(db.joinedload(Group.discipline)),
+                                 [(Group.name, False), (Group.id, False)], id_list(), Group.id)
+    return group_response(items, fields, extra)
+
+
+@bp.route('/groups/<int:group_id>')
+@api_login_required
+def group(group_id):
+    fields = field_list(group_fields, group_fields)
+    found = scope().groups().filter(Group.id == group_id).first()
+    if found is None:
+        abort(404, 'Группа не найдена')
+    return group_response([found], fields, {})
+
+
+# Заказы
+
+order_fields = ['id', 'version', 'student_id', 'order_id', 'order', 'cost', 'status_id', 'status',
+                'commentary', 'timestamp']
+
+
+@bp.route('/orders')
+@api_login_required
+@level_required(Access.ANGEL)
+def orders():
+    fields = field_list(order_fields, order_fields)
+    query = OrderRecord.query.join(Order, Order.id == OrderRecord.order_id).options(
+        db.contains_eager(OrderRecord.order))
+
+    student_ids = id_list('student_ids')
+    if student_ids is not None:
+        query = query.filter(OrderRecord.student_id.in_(student_ids))
+    for name, column in [('order_id', OrderRecord.order_id), ('status_id', OrderRecord.status_id),
+                         ('type_id', Order.type_id)]:
+        value = request.args.get(name, type=int)
+        if value:
+            query = query.filter(column == value)
+
+    items, extra = page_or_batch(query, OrderRecord.page_keys(), id_list(), OrderRecord.id)
+    versions = [(record.id, record.version, record.order.version) for record in items]
+
+    def item(record):
+        result = {}
+        for field in fields:
+            if field == 'order':
+                result[field] = record.order.name
+            elif field == 'status':
+                result[field] = Orders.status(record.order.type_id, record.status_id)
+            elif field == 'timestamp':
+                result[field] = timestamp(record.timestamp)
+            else:
+                result[field] = getattr(record, field)
+        return result
+
+    return conditional((versions, extra), lambda: dict(data=[item(record) for record in items],
+                                                       **extra))
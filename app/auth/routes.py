@@ -1,6 +1,7 @@
 from werkzeug.urls import url_parse
 from flask import render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, current_user
+from app import db
 from app.auth import bp
 from app.auth.forms import LoginForm
 from app.models import Mentor
@@ -16,6 +17,9 @@ def login():
         if user is None or not user.check_password(form.password.data):
             flash('Неправильное имя пользователя или пароль')
             return redirect(url_for('auth.login'))
+        if user.password_needs_rehash():
+            user.set_password(form.password.data)
+            db.session.commit()
         login_user(user, remember=form.remember_me.data)
         next_page = request.args.get('next')
         if not next_page or url_parse(next_page).netloc != '':
@@ -0,0 +1,318 @@
+import json
+import random
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+from sqlalchemy.exc import OperationalError
+from app import app, db
+from app.models import (Mentor, Student, Group, Discipline, Theme, DisciplinePointRecord,
+                        ReferPointRecord, Order, OrderRecord, StudentBalance,
+                        group_students, group_mentors)
+from app.access import Scope
+from app.constants import Access, Orders, OrderStatus
+from app.passwords import hash_password
+
+# Нагрузочные замеры: flask bench seed заполняет пустую базу синтетическими
+# данными, flask bench run открывает основные страницы и пишет итоги в JSON,
+# flask bench compare сравнивает два прогона. Пароль всех менторов - PASSWORD.
+
+PASSWORD = 'bench'
+
+first_names = ['Александр', 'Мария', 'Дмитрий', 'Анна', 'Максим', 'Елизавета', 'Иван',
+               'Дарья', 'Артем', 'Полина', 'Михаил', 'Софья', 'Никита', 'Виктория',
+               'Егор', 'Алиса', 'Кирилл', 'Ксения', 'Андрей', 'Варвара']
+last_names = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов',
+              'Михайлов', 'Новиков', 'Федоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев',
+              'Семенов', 'Егоров', 'Павлов', 'Козлов', 'Степанов', 'Николаев', 'Орлов',
+              'Андреев', 'Макаров', 'Никитин', 'Захаров', 'Зайцев', 'Соловьев', 'Борисов']
+
+
+def insert(table, rows, batch=5000):
+    rows = iter(rows)
+    count = 0
+    while True:
+        chunk = list(islice(rows, batch))
+        if not chunk:
+            return count
+        db.session.execute(table.insert(), chunk)
+        count += len(chunk)
+
+
+def ids(model):
+    return [id for id, in db.session.query(model.id).order_by(model.id)]
+
+
+def seed(groups=2000, students=100000, records=2000000, refers=1000000, orders=1000000,
+         disciplines=20, themes=30, random_seed=1, log=print):
+    rnd = random.Random(random_seed)
+    now = datetime.utcnow()
+
+    def moment():
+        return now - timedelta(seconds=rnd.randrange(365 * 24 * 3600))
+
+    insert(Discipline.__table__, (dict(name='Предмет %i' % i) for i in range(1, disciplines + 1)))
+    discipline_ids = ids(Discipline)
+    insert(Theme.__table__, (dict(name='Тема %i' % i, max_points=rnd.choice([5, 10, 20, 50]),
+                                  discipline_id=d) for d in discipline_ids for i in range(1, themes + 1)))
+    theme_rows = db.session.query(Theme.id, Theme.discipline_id, Theme.max_points).all()
+    themes_by_discipline = {}
+    for theme in theme_rows:
+        themes_by_discipline.setdefault(theme.discipline_id, []).append(theme)
+    log('Предметов: %i, тем: %i' % (len(discipline_ids), len(theme_rows)))
+
+    insert(Group.__table__, (dict(name='Группа %05i' % i, discipline_id=rnd.choice(discipline_ids))
+                             for i in range(1, groups + 1)))
+    group_rows = db.session.query(Group.id, Group.discipline_id).order_by(Group.id).all()
+    log('Групп: %i' % len(group_rows))
+
+    # Менторы всех уровней, у наставника в среднем по четыре группы
+    password_hash = hash_password(PASSWORD)
+    mentors = [('bench_admin', Access.SUPER_ADMIN, None), ('bench_admin_2', Access.ADMIN, None)]
+    mentors += [('bench_angel_%i' % i, Access.ANGEL, None) for i in range(1, 6)]
+    mentors += [('bench_hawk_%i' % i, Access.HAWK, None) for i in range(1, 6)]
+    mentors += [('bench_up_%i' % d, Access.UP_MENTOR, d) for d in discipline_ids]
+    mentors += [('bench_mentor_%i' % i, Access.MENTOR, rnd.choice(discipline_ids))
+                for i in range(1, max(groups // 4, 1) + 1)]
+    insert(Mentor.__table__, (dict(username=username, first_name=rnd.choice(first_names),
+                                   last_name=rnd.choice(last_names), password_hash=password_hash,
+                                   access_level=level, discipline_id=discipline_id)
+                              for username, level, discipline_id in mentors))
+    mentor_rows = db.session.query(Mentor.id, Mentor.access_level, Mentor.discipline_id).all()
+    teachers = {}
+    for mentor in mentor_rows:
+        if mentor.access_level == Access.MENTOR:
+            teachers.setdefault(mentor.discipline_id, []).append(mentor.id)
+    graders = [mentor.id for mentor in mentor_rows if mentor.access_level != Access.HAWK]
+
+    mentor_groups = set()
+    for group in group_rows:
+        candidates = teachers.get(group.discipline_id) or [rnd.choice(mentor_rows).id]
+        mentor_groups.add((group.id, rnd.choice(candidates)))
+    insert(group_mentors, (dict(group_id=group_id, mentor_id=mentor_id)
+                           for group_id, mentor_id in mentor_groups))
+    log('Менторов: %i' % len(mentor_rows))
+
+    insert(Student.__table__, (dict(first_name=rnd.choice(first_names),
+                                    last_name=rnd.choice(last_names) + rnd.choice(['', 'а']),
+                                    vk_id=100000000 + i) for i in range(students)))
+    student_ids = ids(Student)
+
+    # Студент в одной-двух группах
+    membership = {}
+    for student_id in student_ids:
+        membership[student_id] = rnd.sample(group_rows, rnd.choice([1, 1, 1, 2]))
+    insert(group_students, (dict(student_id=student_id, group_id=group.id)
+                            for student_id, student_groups in membership.items()
+                            for group in student_groups))
+    log('Студентов: %i' % len(student_ids))
+
+    balances = {student_id: [0, 0, 0] for student_id in student_ids}
+
+    def attempts(count):
+        # Повторы пропускаются, поэтому пробуем с запасом, пока не наберется count
+        return range(count * 3)
+
+    def discipline_records():
+        # Тема у студента не повторяется
+        taken = set()
+        for _ in attempts(records):
+            if len(taken) >= records:
+                return
+            student_id = rnd.choice(student_ids)
+            theme = rnd.choice(themes_by_discipline[rnd.choice(membership[student_id]).discipline_id])
+            if (student_id, theme.id) in taken:
+                continue
+            taken.add((student_id, theme.id))
+            balances[student_id][0] += theme.max_points
+            yield dict(timestamp=moment(), amount=theme.max_points, student_id=student_id,
+                       theme_id=theme.id, mentor_id=rnd.choice(graders))
+
+    log('Записей за учебу: %i' % insert(DisciplinePointRecord.__table__, discipline_records()))
+
+    def refer_records():
+        for i in range(refers):
+            student_id = rnd.choice(student_ids)
+            amount = app.config['REFER_RECORD_POINTS']
+            balances[student_id][1] += amount
+            yield dict(refer_vk_id=200000000 + i, timestamp=moment(), amount=amount,
+                       student_id=student_id, mentor_id=rnd.choice(graders))
+
+    log('Записей за приглашения: %i' % insert(ReferPointRecord.__table__, refer_records()))
+
+    insert(Order.__table__, (dict(name='Подарок %i' % i, cost=rnd.choice([10, 50, 100, 200]),
+                                  description='', type_id=rnd.choice([Orders.Set, Orders.Discount]))
+                             for i in range(1, 51)))
+    order_rows = db.session.query(Order.id, Order.cost).all()
+
+    def order_records():
+        # Как на сайте: подарок один раз и только если хватает баллов
+        taken = set()
+        for _ in attempts(orders):
+            if len(taken) >= orders:
+                return
+            student_id = rnd.choice(student_ids)
+            order = rnd.choice(order_rows)
+            discipline, refer, spent = balances[student_id]
+            if (student_id, order.id) in taken or discipline + refer - spent < order.cost:
+                continue
+            taken.add((student_id, order.id))
+            balances[student_id][2] += order.cost
+            yield dict(cost=order.cost, timestamp=moment(), commentary='', student_id=student_id,
+                       order_id=order.id, status_id=rnd.choice([OrderStatus.Ordered, OrderStatus.Sent,
+                                                                OrderStatus.Done, OrderStatus.Done]))
+
+    log('Заказов: %i' % insert(OrderRecord.__table__, order_records()))
+
+    insert(StudentBalance.__table__, (dict(student_id=student_id, discipline_points=d,
+                                           refer_points=r, spent_points=s, total=d + r - s)
+                                      for student_id, (d, r, s) in balances.items()))
+    db.session.commit()
+
+
+def targets(user, count, random_seed=1):
+    # Адреса страниц для замера, только доступные пользователю
+    rnd = random.Random(random_seed)
+    scope = Scope(user)
+
+    def sample(query, column):
+        values = [value for value, in query.with_entities(column).order_by(column).limit(10000)]
+        return [rnd.choice(values) for _ in range(count)] if values else []
+
+    group_ids = sample(scope.groups(), Group.id)
+    student_ids = sample(scope.students(), Student.id)
+    names = sample(scope.students(), Student.last_name)
+
+    return {
+        'main.group_list': ['/group/list'] * count,
+        'main.group': ['/group/id/%i' % i for i in group_ids],
+        'students.student': ['/student/id/%i' % i for i in student_ids],
+        'main.disc_table': ['/table/discipline/%i' % i for i in student_ids],
+        'main.order_table': ['/table/orders/%i' % i for i in student_ids],
+        'students.list': ['/student/list?q=%s' % name[:rnd.randint(3, len(name))] for name in names if name]
+    }
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(user, count=50, threads=1, log=print):
+    def client():
+        result = app.test_client()
+        with result.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+        return result
+
+    # Тестовый клиент не потокобезопасен, у каждого потока свой
+    local = threading.local()
+    endpoints = {}
+    for endpoint, urls in targets(user, count).items():
+        if not urls:
+            continue
+
+        def fetch(url):
+            if not hasattr(local, 'client'):
+                local.client = client()
+            start = time.perf_counter()
+            response = local.client.get(url)
+            elapsed = time.perf_counter() - start
+            # X-SQL-Stats: queries=12; time=3.4ms; repeated=0
+            stats = dict(item.split('=') for item in
+                         response.headers.get('X-SQL-Stats', '').split('; ') if '=' in item)
+            return elapsed, response.status_code, int(stats.get('queries', 0))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            results = list(executor.map(fetch, urls))
+        total = time.perf_counter() - start
+
+        latencies = [elapsed * 1000 for elapsed, status, queries in results]
+        endpoints[endpoint] = dict(
+            requests=len(results),
+            errors=sum(1 for elapsed, status, queries in results if status >= 400),
+            redirects=sum(1 for elapsed, status, queries in results if 300 <= status < 400),
+            mean_ms=sum(latencies) / len(latencies),
+            p50_ms=percentile(latencies, 0.5),
+            p95_ms=percentile(latencies, 0.95),
+            rps=len(results) / total,
+            queries=sum(queries for elapsed, status, queries in results) / len(results)
+        )
+        log('%-18s p50 %7.1f мс  p95 %7.1f мс  %6.1f запр/с  %5.1f SQL' % (
+            endpoint, endpoints[endpoint]['p50_ms'], endpoints[endpoint]['p95_ms'],
+            endpoints[endpoint]['rps'], endpoints[endpoint]['queries']))
+
+    return dict(timestamp=datetime.utcnow().isoformat(), database=db.engine.dialect.name,
+                user=user.username, access_level=user.access_level, threads=threads,
+                rows=dict(groups=Group.query.count(), students=Student.query.count(),
+                          discipline_records=DisciplinePointRecord.query.count(),
+                          refer_records=ReferPointRecord.query.count(),
+                          order_records=OrderRecord.query.count()),
+                endpoints=endpoints)
+
+
+def spend_race(threads=8, attempts=100, cost=10, budget=200, log=print):
+    # Ручная проверка (flask bench spend), автотестов в проекте нет. Параллельные
+    # заказы одному студенту: баланс не должен уйти в минус, а заказов должно пройти
+    # ровно budget // cost. Строки баланса нет, ее создают сами первые заказы
+    student = Student(first_name='Проверка', last_name='Списаний')
+    order = Order(name='Проверка списаний %i' % random.randrange(10 ** 6), cost=cost,
+                  description='', type_id=Orders.Set)
+    db.session.add_all([student, order])
+    db.session.flush()
+    db.session.add(ReferPointRecord(student_id=student.id, amount=budget,
+                                    refer_vk_id=-random.randrange(1, 10 ** 9)))
+    db.session.commit()
+    student_id, order_id = student.id, order.id
+
+    def attempt(_):
+        with app.app_context():
+            try:
+                if not StudentBalance.spend(student_id, cost):
+                    return False
+                db.session.add(OrderRecord(cost=cost, status_id=OrderStatus.Ordered,
+                                           student_id=student_id, order_id=order_id))
+                db.session.commit()
+                return True
+            except OperationalError:
+                # SQLite: не дождались блокировки записи
+                db.session.rollback()
+                return None
+            finally:
+                db.session.remove()
+
+    with ThreadPoolExecutor(threads) as executor:
+        results = list(executor.map(attempt, range(attempts)))
+
+    balance = StudentBalance.query.get(student_id)
+    db.session.refresh(balance)
+    placed = OrderRecord.query.filter_by(student_id=student_id).count()
+    result = dict(placed=placed, accepted=results.count(True), refused=results.count(False),
+                  errors=results.count(None), total=balance.total, spent=balance.spent_points)
+    log('Заказов: %(placed)i, отказов: %(refused)i, ошибок блокировки: %(errors)i, '
+        'остаток: %(total)i, списано: %(spent)i' % result)
+
+    OrderRecord.query.filter_by(student_id=student_id).delete()
+    ReferPointRecord.query.filter_by(student_id=student_id).delete()
+    db.session.delete(balance)
+    Student.query.filter_by(id=student_id).delete()
+    Order.query.filter_by(id=order_id).delete()
+    db.session.commit()
+
+    expected = min(attempts - result['errors'], budget // cost)
+    result['ok'] = result['total'] >= 0 and placed == result['accepted'] == expected and \
+        result['spent'] == placed * cost
+    return result
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save(result, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,56 @@
+import time
+import threading
+from collections import OrderedDict
+
+_missing = object()
+
+
+# Ограниченный по размеру кэш на процесс, с вытеснением давно не использованных
+# и необязательным временем жизни записей
+class LRUCache:
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _missing)
+            if entry is not _missing and self.ttl is not None and \
+                    time.monotonic() - entry[1] > self.ttl:
+                del self._data[key]
+                entry = _missing
+
+            if entry is _missing:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        return dict(size=len(self._data), maxsize=self.maxsize,
+                    hits=self.hits, misses=self.misses)
+
+    def __len__(self):
+        return len(self._data)
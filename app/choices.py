@@ -0,0 +1,115 @@
+from flask import url_for
+from sqlalchemy import event
+from wtforms import SelectField
+from app import app, db
+from app.cache import LRUCache
+from app.models import Group, Discipline, Theme, Order, group_students, group_mentors
+from app.pagination import keyset_paginate
+
+# Варианты для SelectField и поиск для полей с подсказками.
+# Небольшие списки (предметы, темы, подарки) кэшируются по поколению таблиц:
+# после commit изменений Group, Discipline, Theme или Order поколение
+# увеличивается и старые списки больше не берутся.
+# Другие процессы увидят изменения не позже чем через CHOICE_CACHE_TTL секунд.
+
+lists = LRUCache(app.config['CHOICE_CACHE_SIZE'], app.config['CHOICE_CACHE_TTL'])
+generations = {}
+tracked = (Group, Discipline, Theme, Order)
+
+
+def generation(*models):
+    return tuple(generations.get(model.__tablename__, 0) for model in models)
+
+
+def cached(name, models, key, build):
+    cache_key = (name, key) + generation(*models)
+    value = lists.get(cache_key)
+    if value is None:
+        value = build()
+        lists.set(cache_key, value)
+    return value
+
+
+@event.listens_for(db.session, 'after_flush')
+def remember_changes(session, context):
+    changed = session.info.setdefault('choice_tables', set())
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, tracked):
+            changed.add(instance.__tablename__)
+
+
+@event.listens_for(db.session, 'after_commit')
+def bump_generations(session):
+    for table in session.info.pop('choice_tables', ()):
+        generations[table] = generations.get(table, 0) + 1
+
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_changes(session):
+    session.info.pop('choice_tables', None)
+
+
+def disciplines():
+    # [(id, название)]
+    return cached('disciplines', [Discipline], None, lambda: [
+        (id, name) for id, name in
+        db.session.query(Discipline.id, Discipline.name).order_by(Discipline.name, Discipline.id)])
+
+
+def theme_labels():
+    # {id темы: 'Предмет Тема'} - без загрузки предмета на каждую тему
+    return cached('themes', [Theme, Discipline], None, lambda: {
+        id: discipline + ' ' + name for id, name, discipline in
+        db.session.query(Theme.id, Theme.name, Discipline.name).join(
+            Discipline, Discipline.id == Theme.discipline_id)})
+
+
+def orders():
+    # [(id, название, стоимость)]
+    return cached('orders', [Order], None, lambda: [
+        tuple(row) for row in
+        db.session.query(Order.id, Order.name, Order.cost).order_by(Order.id)])
+
+
+def like(column, q):
+    q = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return column.ilike('%' + q + '%', escape='\\')
+
+
+def search_groups(query, q='', cursor=None, discipline_id=None, student_id=None, mentor_id=None):
+    # Страница групп для подсказок, без кэша - групп тысячи, а запрос с LIMIT.
+    # query - группы, которые видит текущий пользователь, см. app/access.py
+    # {'results': [{'id', 'text'}], 'next': курсор следующей страницы}
+    if q:
+        query = query.filter(like(Group.name, q))
+    if discipline_id:
+        query = query.filter(Group.discipline_id == discipline_id)
+    if student_id:
+        query = query.filter(~db.exists().where(db.and_(
+            group_students.c.group_id == Group.id,
+            group_students.c.student_id == student_id)).correlate(Group))
+    if mentor_id:
+        query = query.filter(~db.exists().where(db.and_(
+            group_mentors.c.group_id == Group.id,
+            group_mentors.c.mentor_id == mentor_id)).correlate(Group))
+
+    page = keyset_paginate(query, [(Group.name, False), (Group.id, False)],
+                           app.config['TYPEAHEAD_PER_PAGE'], cursor, count=False)
+    return dict(results=[dict(id=group.id, text=group.name) for group in page.items],
+                next=page.next_cursor)
+
+
+class TypeaheadField(SelectField):
+    # Выпадающий список, который заполняется подсказками с сервера (скрипт в base.html).
+    # Варианты заранее не загружаются, значение проверяет сама форма
+    def __init__(self, label=None, validators=None, endpoint=None, params=None, **kwargs):
+        super(TypeaheadField, self).__init__(label, validators, coerce=int, choices=[], **kwargs)
+        self.endpoint = endpoint
+        self.params = params or {}
+
+    def __call__(self, **kwargs):
+        kwargs.setdefault('data-typeahead', url_for(self.endpoint, **self.params))
+        return super(TypeaheadField, self).__call__(**kwargs)
+
+    def pre_validate(self, form):
+        pass
@@ -0,0 +1,284 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import click
+from app import db
+from app.models import Mentor, Student, StudentBalance, OutboundMessage, ProcessedEvent, ledger_totals
+from app.constants import Access, OutboundStatus
+from app.communities.dispatcher import Dispatcher
+from app.search import get_backend
+from app.passwords import hashers, get_hasher
+from app.advisor import advisor
+from app import bench as benchmarks
+from app import history as records
+from app.api.auth import make_token
+
+
+def register(app):
+    @app.cli.group()
+    def balance():
+        """Балансы студентов."""
+        pass
+
+    @balance.command()
+    def rebuild():
+        """Пересчитать балансы по записям."""
+        totals = ledger_totals()
+        StudentBalance.query.delete()
+        rows = []
+        for student_id, in db.session.query(Student.id):
+            discipline, refer, spent = totals.get(student_id, (0, 0, 0))
+            rows.append(dict(student_id=student_id, discipline_points=discipline,
+                             refer_points=refer, spent_points=spent,
+                             total=discipline + refer - spent))
+        db.session.bulk_insert_mappings(StudentBalance, rows)
+        db.session.commit()
+        click.echo('Пересчитано балансов: %i' % len(rows))
+
+    @balance.command()
+    def check():
+        """Сверить балансы с записями."""
+        totals = ledger_totals()
+        stored = {b.student_id: (b.discipline_points, b.refer_points, b.spent_points, b.total)
+                  for b in StudentBalance.query}
+
+        errors = 0
+        for student_id, in db.session.query(Student.id):
+            discipline, refer, spent = totals.get(student_id, (0, 0, 0))
+            expected = (discipline, refer, spent, discipline + refer - spent)
+            actual = stored.get(student_id)
+            if actual is not None and actual != expected or \
+                    actual is None and expected != (0, 0, 0, 0):
+                errors += 1
+                click.echo('Студент %i: сохранено %s, по записям %s' % (student_id, actual, expected))
+
+        if errors:
+            raise click.ClickException('Расхождений: %i, выполните flask balance rebuild' % errors)
+        click.echo('Балансы совпадают с записями')
+
+    @app.cli.group()
+    def history():
+        """Загрузка старых записей."""
+        pass
+
+    @history.command('import')
+    @click.argument('kind', type=click.Choice(list(records.importers)))
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--mentor', 'username', help='Ментор для строк без столбца mentor.')
+    @click.option('--chunk', default=5000, help='Строк в одной транзакции.')
+    @click.option('--checkpoint', help='Имя сохраненного прогресса, по умолчанию полный путь к PATH.')
+    @click.option('--restart', is_flag=True, help='Начать сначала, не глядя на сохраненный прогресс.')
+    def history_import(kind, path, username, chunk, checkpoint, restart):
+        """Загрузить записи из CSV: discipline, refer или order.
+
+        Столбцы discipline: vk_id, discipline, theme, amount, date, mentor.
+        Столбцы refer: vk_id, refer_vk_id, amount, date, mentor.
+        Столбцы order: vk_id, order, cost, status, date, commentary.
+        Прерванная загрузка продолжается с последней сохраненной пачки."""
+        mentor_id = None
+        if username:
+            mentor = Mentor.query.filter_by(username=username).first()
+            if mentor is None:
+                raise click.ClickException('Ментор не найден')
+            mentor_id = mentor.id
+
+        try:
+            progress = records.run(kind, path, mentor_id=mentor_id, chunk_size=chunk,
+                                   checkpoint=checkpoint, restart=restart, log=click.echo)
+        except ValueError as error:
+            raise click.ClickException(str(error))
+        click.echo('Готово: добавлено %i, пропущено %i, ошибок %i' % (
+            progress.imported, progress.skipped, progress.errors))
+
+    @app.cli.group()
+    def api():
+        """JSON API для интеграций."""
+        pass
+
+    @api.command()
+    @click.argument('username')
+    def token(username):
+        """Выдать токен API от имени ментора.
+
+        Токен действует API_TOKEN_MAX_AGE секунд или до смены пароля ментора."""
+        mentor = Mentor.query.filter_by(username=username).first()
+        if mentor is None:
+            raise click.ClickException('Ментор не найден')
+        click.echo(make_token(mentor))
+
+    @app.cli.group()
+    def bot():
+        """Очередь сообщений бота."""
+        pass
+
+    @bot.command()
+    @click.option('--workers', type=int, help='Количество потоков отправки.')
+    @click.option('--per-community', type=int, help='Одновременных отправок на сообщество.')
+    @click.option('--once', is_flag=True, help='Выйти, когда не останется готовых к отправке сообщений.')
+    def worker(workers, per_community, once):
+        """Отправлять сообщения из очереди."""
+        Dispatcher(app, workers, per_community).run(once=once)
+
+    @bot.command()
+    @click.option('--days', default=7, help='Сколько дней хранить.')
+    def purge(days):
+        """Удалить старые отправленные сообщения и обработанные события."""
+        deleted = OutboundMessage.query.filter(
+            OutboundMessage.status_id == OutboundStatus.Sent,
+            OutboundMessage.timestamp < datetime.utcnow() - timedelta(days=days)
+        ).delete(synchronize_session=False)
+        events = ProcessedEvent.query.filter(
+            ProcessedEvent.timestamp < datetime.utcnow() - timedelta(days=days)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        click.echo('Удалено сообщений: %i, событий: %i' % (deleted, events))
+
+    @app.cli.group()
+    def search():
+        """Поиск студентов."""
+        pass
+
+    @search.command('rebuild')
+    def rebuild_index():
+        """Создать и заново заполнить поисковый индекс."""
+        backend = get_backend()
+        backend.install()
+        backend.rebuild()
+        db.session.commit()
+        click.echo('Индекс перестроен: %s' % type(backend).__name__)
+
+    @app.cli.group()
+    def password():
+        """Пароли менторов."""
+        pass
+
+    @password.command()
+    @click.option('--hasher', 'name', type=click.Choice(list(hashers)), help='Схема, по умолчанию из конфига.')
+    @click.option('--cost', type=int, multiple=True,
+                  help='Итерации PBKDF2 или раунды bcrypt, можно указать несколько.')
+    @click.option('--count', default=20, help='Сколько входов проверить.')
+    @click.option('--threads', default=1, help='Одновременных проверок, как потоков у воркера.')
+    def benchmark(name, cost, count, threads):
+        """Замерить скорость проверки паролей при входе."""
+        for value in cost or [None]:
+            hasher = get_hasher(name, value)
+            start = time.perf_counter()
+            password_hash = hasher.hash('benchmark-password')
+            hash_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(threads) as executor:
+                results = list(executor.map(lambda _: hasher.verify('benchmark-password', password_hash),
+                                            range(count)))
+            elapsed = time.perf_counter() - start
+            if not all(results):
+                raise click.ClickException('Проверка пароля не прошла: %s' % hasher.name)
+
+            click.echo('%s, стоимость %s: хэш %.1f мс, проверка %.1f мс, %.1f входов/с (%i потоков)' % (
+                hasher.name, hasher.cost,
+                hash_time * 1000, elapsed / count * threads * 1000, count / elapsed, threads))
+
+    @app.cli.group()
+    def sql():
+        """Запросы к базе."""
+        pass
+
+    @sql.command()
+    @click.argument('urls', nargs=-1)
+    @click.option('--user', 'username', help='Ментор, от имени которого открывать страницы.')
+    def advise(urls, username):
+        """Открыть страницы и показать запросы с полным просмотром таблиц.
+
+        Без URLS открываются все страницы без параметров."""
+        if username:
+            user = Mentor.query.filter_by(username=username).first()
+        else:
+            user = Mentor.query.filter_by(access_level=Access.SUPER_ADMIN).first()
+        if user is None:
+            raise click.ClickException('Ментор не найден')
+
+        if not urls:
+            urls = sorted(rule.rule for rule in app.url_map.iter_rules()
+                          if 'GET' in rule.methods and not rule.arguments
+                          and rule.endpoint not in ['static', 'auth.logout'])
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+
+        advisor.clear()
+        advisor.enable()
+        for url in urls:
+            response = client.get(url)
+            click.echo('%s %s' % (response.status_code, url))
+        advisor.disable()
+
+        report = advisor.report()
+        for endpoint, statements in report.items():
+            click.echo('\n%s' % endpoint)
+            for tables, statement in statements:
+                click.echo('  %s: %s' % (', '.join(tables), ' '.join(statement.split())[:300]))
+        if not report:
+            click.echo('Полных просмотров таблиц нет')
+
+    @app.cli.group()
+    def bench():
+        """Нагрузочные замеры на синтетических данных."""
+        pass
+
+    @bench.command('seed')
+    @click.option('--groups', default=2000)
+    @click.option('--students', default=100000)
+    @click.option('--records', default=2000000, help='Записей за учебу.')
+    @click.option('--refers', default=1000000, help='Записей за приглашения.')
+    @click.option('--orders', default=1000000, help='Заказов.')
+    @click.option('--random-seed', default=1, help='Одинаковое значение дает одинаковые данные.')
+    def bench_seed(groups, students, records, refers, orders, random_seed):
+        """Заполнить пустую базу синтетическими данными."""
+        if Student.query.first() is not None or Mentor.query.first() is not None:
+            raise click.ClickException('База не пуста, используйте отдельную базу для замеров')
+        benchmarks.seed(groups=groups, students=students, records=records, refers=refers,
+                        orders=orders, random_seed=random_seed, log=click.echo)
+        click.echo('Готово, пароль менторов: %s' % benchmarks.PASSWORD)
+
+    @bench.command('run')
+    @click.option('--user', 'username', default='bench_admin', help='Ментор, от имени которого открывать страницы.')
+    @click.option('--count', default=50, help='Запросов на страницу.')
+    @click.option('--threads', default=1, help='Одновременных запросов.')
+    @click.option('--output', type=click.Path(), help='Сохранить итоги в JSON.')
+    def bench_run(username, count, threads, output):
+        """Замерить время ответа основных страниц."""
+        user = Mentor.query.filter_by(username=username).first()
+        if user is None:
+            raise click.ClickException('Ментор не найден, сначала flask bench seed')
+        if not app.config['SQL_STATS'] or not user.is_admin():
+            click.echo('Число SQL-запросов не считается: нужны SQL_STATS=1 и ментор-админ')
+        result = benchmarks.run(user, count=count, threads=threads, log=click.echo)
+        if output:
+            benchmarks.save(result, output)
+            click.echo('Сохранено в %s' % output)
+
+    @bench.command('spend')
+    @click.option('--threads', default=8, help='Одновременных заказов.')
+    @click.option('--attempts', default=100, help='Всего попыток заказа.')
+    def bench_spend(threads, attempts):
+        """Проверить вручную, что параллельные заказы не уводят баланс в минус."""
+        result = benchmarks.spend_race(threads=threads, attempts=attempts, log=click.echo)
+        if not result['ok']:
+            raise click.ClickException('Списания разошлись с балансом')
+        click.echo('Баланс не ушел в минус')
+
+    @bench.command('compare')
+    @click.argument('before', type=click.Path(exists=True))
+    @click.argument('after', type=click.Path(exists=True))
+    def bench_compare(before, after):
+        """Сравнить два сохраненных прогона."""
+        before, after = benchmarks.load(before), benchmarks.load(after)
+        for endpoint, new in after['endpoints'].items():
+            old = before['endpoints'].get(endpoint)
+            if old is None:
+                continue
+            click.echo('%-18s p50 %7.1f -> %7.1f мс (%+.0f%%)  p95 %7.1f -> %7.1f мс  SQL %5.1f -> %5.1f' % (
+                endpoint, old['p50_ms'], new['p50_ms'], (new['p50_ms'] / old['p50_ms'] - 1) * 100,
+                old['p95_ms'], new['p95_ms'], old['queries'], new['queries']))
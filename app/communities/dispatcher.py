@@ -0,0 +1,113 @@
+import time
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import vk_api
+from app import db
+from app.models import OutboundMessage
+from app.vk import vk_session
+
+# Ошибки VK, при которых повторная отправка не поможет
+# 7 - нет прав, 900/901/902 - пользователь запретил сообщения
+PERMANENT_ERRORS = {7, 900, 901, 902}
+
+
+class Dispatcher:
+    def __init__(self, app, workers=None, per_community=None):
+        self.app = app
+        self.workers = workers or app.config['VK_SEND_WORKERS']
+        self.per_community = per_community or app.config['VK_COMMUNITY_CONCURRENCY']
+        self.max_attempts = app.config['VK_SEND_MAX_ATTEMPTS']
+        self.lease = timedelta(seconds=app.config['VK_SEND_LEASE'])
+
+        self._pool = ThreadPoolExecutor(self.workers)
+        self._lock = threading.Lock()
+        self._in_flight = Counter()
+
+    def run(self, once=False, poll_interval=1.0):
+        # once - выйти, когда очередь опустеет
+        try:
+            while True:
+                claimed = self.dispatch()
+                if once and not claimed and not self.busy():
+                    break
+                if not claimed:
+                    time.sleep(poll_interval)
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def busy(self):
+        with self._lock:
+            return sum(self._in_flight.values())
+
+    def dispatch(self):
+        free = self.workers - self.busy()
+        if free <= 0:
+            return 0
+
+        claimed = 0
+        with self.app.app_context():
+            now = datetime.utcnow()
+            candidates = OutboundMessage.ready(now).with_entities(
+                OutboundMessage.id, OutboundMessage.vk_group_id
+            ).limit(free * self.per_community).all()
+
+            for message_id, group_id in candidates:
+                if claimed >= free:
+                    break
+                with self._lock:
+                    if self._in_flight[group_id] >= self.per_community:
+                        continue
+                if not OutboundMessage.claim(message_id, now, now + self.lease):
+                    continue
+                db.session.commit()
+
+                with self._lock:
+                    self._in_flight[group_id] += 1
+                self._pool.submit(self._deliver, message_id, group_id)
+                claimed += 1
+
+        return claimed
+
+    def _deliver(self, message_id, group_id):
+        try:
+            with self.app.app_context():
+                self.deliver(message_id)
+        except Exception:
+            self.app.logger.exception('Не удалось обработать сообщение %i', message_id)
+        finally:
+            with self._lock:
+                self._in_flight[group_id] -= 1
+
+    def deliver(self, message_id):
+        message = OutboundMessage.query.get(message_id)
+        if message is None:
+            return
+        group = message.vk_group
+
+        try:
+            if group is None or not group.token:
+                message.fail('Нет сообщества или его токена', self.max_attempts, permanent=True)
+            else:
+                with vk_session(group.token) as vk:
+                    vk.method('messages.send', {
+                        'peer_id': message.peer_id,
+                        'message': message.message,
+                        'random_id': message.random_id
+                    })
+                message.sent()
+        except vk_api.ApiError as error:
+            message.fail(error, self.max_attempts, permanent=error.code in PERMANENT_ERRORS)
+        except Exception as error:
+            # Любая ошибка - это попытка, иначе сообщение так и останется в Sending
+            # и будет забираться снова после каждой аренды
+            message.fail(error, self.max_attempts)
+
+        try:
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()
+            message = OutboundMessage.query.get(message_id)
+            message.fail(error, self.max_attempts)
+            db.session.commit()
@@ -0,0 +1,41 @@
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from app.cache import LRUCache
+from app.models import ProcessedEvent
+
+recent_events = LRUCache(app.config['VK_EVENT_CACHE_SIZE'], app.config['VK_EVENT_CACHE_TTL'])
+
+
+def event_key(data):
+    # event_id есть в Callback API начиная с 5.103, для старых версий - id сообщения
+    if data.get('event_id'):
+        return str(data['event_id'])
+    message = data['object'].get('message', data['object'])
+    if message.get('id') or message.get('conversation_message_id'):
+        return 'message:%s:%s' % (message.get('id'), message.get('conversation_message_id'))
+    return None
+
+
+def is_duplicate(group_id, event_id):
+    # Должно вызываться до любых других изменений в сессии
+    if event_id is None:
+        return False
+
+    key = (group_id, event_id)
+    if recent_events.get(key):
+        return True
+
+    db.session.add(ProcessedEvent(vk_group_id=group_id, event_id=event_id))
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        recent_events.set(key, True)
+        return True
+    return False
+
+
+def remember(group_id, event_id):
+    # После commit, что бы неудачная обработка не помечала событие
+    if event_id is not None:
+        recent_events.set((group_id, event_id), True)
@@ -1,12 +1,13 @@
 import secrets
 from flask import request, redirect, url_for, render_template, flash, g
-import vk_api
-from vk_api.utils import get_random_id
 from app import app, db
-from app.models import VkGroup, Student
+from app.models import VkGroup, Student, OutboundMessage
 from app.communities import bp
 from app.communities.forms import VkGroupForm, VkGroupChangeForm
+from app.communities.events import event_key, is_duplicate, remember
 from app.utils import admin_required
+from app.vk import vk_session
+from app.pagination import paginate
 
 
 # Адрес для запроса боту
@@ -26,31 +27,29 @@ def bot():
     if data['type'] == 'confirmation':
         return group.confirmation_key
 
-    vk_session = vk_api.VkApi(token=group.token)
-    vk = vk_session.get_api()
-
+    # Ответ отправит воркер очереди, вебхук отвечает VK сразу
     if data['type'] == 'message_new':
-        if 'user_id' in data['object']:
-            from_id = data['object']['user_id']
-        elif 'from_id' in data['object']:
-            from_id = data['object']['from_id']
+        # С версии API 5.103 сообщение вложено в object.message
+        message = data['object'].get('message', data['object'])
+        if 'user_id' in message:
+            from_id = message['user_id']
+        elif 'from_id' in message:
+            from_id = message['from_id']
         else:
             return 'not ok'
 
+        # VK повторяет событие, если ответ был медленным
+        key = event_key(data)
+        if is_duplicate(group.id, key):
+            return 'ok'
+
         student = Student.query.filter_by(vk_id=from_id).first()
         if student is None:
-            vk.messages.send(
-                message='К сожалению, ты не являешься нашим учеником',
-                random_id=get_random_id(),
-                peer_id=from_id
-            )
-
+            OutboundMessage.enqueue(group, from_id, 'К сожалению, ты не являешься нашим учеником')
         else:
-            vk.messages.send(
-                message=group.answer(student),
-                random_id=get_random_id(),
-                peer_id=from_id
-            )
+            OutboundMessage.enqueue(group, from_id, group.answer(student))
+        db.session.commit()
+        remember(group.id, key)
 
     return 'ok'
 
@@ -58,40 +57,35 @@ def bot():
 @bp.route('/list', methods=['GET', 'POST'])
 @admin_required
 def list():
-    data = VkGroup.query.order_by(VkGroup.name)
-
     form = VkGroupForm()
-    page = request.args.get('page', 1, type=int)
 
     if form.validate_on_submit():
         token = form.token.data
 
-        vk_session = vk_api.VkApi(token=token)
-        vk = vk_session.get_api()
-
         id = form.vk_id.data
-        confirm = vk.groups.getCallbackConfirmationCode(group_id=id)['code']
-        name = vk.groups.getById(group_id=id)[0]['name']
         secret_key = secrets.token_hex(24)
+        with vk_session(token) as session:
+            vk = session.get_api()
+            confirm = vk.groups.getCallbackConfirmationCode(group_id=id)['code']
+            name = vk.groups.getById(group_id=id)[0]['name']
 
-        group = VkGroup(id=id, name=name, token=token,
-                        confirmation_key=confirm, secret_key=secret_key)
+            group = VkGroup(id=id, name=name, token=token,
+                            confirmation_key=confirm, secret_key=secret_key)
 
-        server_id = vk.groups.addCallbackServer(group_id=id, title="Point Site", secret_key=secret_key,
-                                                url=app.config['BOT_URL'])
+            server_id = vk.groups.addCallbackServer(group_id=id, title="Point Site", secret_key=secret_key,
+                                                    url=app.config['BOT_URL'])
 
-        vk.groups.setCallbackSettings(group_id=group.id, server_id=server_id['server_id'],
-                                      message_new=1)
+            vk.groups.setCallbackSettings(group_id=group.id, server_id=server_id['server_id'],
+                                          message_new=1)
 
         db.session.add(group)
         db.session.commit()
 
         flash('Группа %s добавлена' % group.name)
-        return redirect(url_for('communities.list', page=page))
+        return redirect(url_for('communities.list'))
 
-    data = VkGroup.query.order_by(VkGroup.name).paginate(
-        page, 20, False
-    )
+    data = paginate(VkGroup.query, [(VkGroup.name, False), (VkGroup.id, False)],
+                    app.config['COMMUNITIES_PER_PAGE'])
     g.url_for = 'communities.list'
 
     return render_template('data_list.html', form=form,
@@ -33,14 +33,16 @@ mentors = Nav('Менторы', 'admins.index')
 disciplines = Nav('Предметы', 'disciplines.index')
 orders = Nav('Подарки', 'main.order_list')
 communities = Nav('Сообщества', 'communities.list')
+rating = Nav('Рейтинг', 'main.leaderboard')
+queue = Nav('Выдача', 'main.order_queue')
 
 navs = {
     Access.MENTOR: [groups],
     Access.UP_MENTOR: [groups, mentors],
-    Access.HAWK: [students],
-    Access.ANGEL: [groups, students, orders],
-    Access.ADMIN: [groups, students, disciplines, orders, mentors, communities],
-    Access.SUPER_ADMIN: [groups, students, disciplines, orders, mentors, communities]
+    Access.HAWK: [students, rating],
+    Access.ANGEL: [groups, students, orders, queue, rating],
+    Access.ADMIN: [groups, students, disciplines, orders, queue, mentors, communities, rating],
+    Access.SUPER_ADMIN: [groups, students, disciplines, orders, queue, mentors, communities, rating]
 }
 
 # Сообщества
@@ -64,3 +66,11 @@ class OrderStatus:
     Ordered = 1
     Sent = 2
     Done = 3
+
+
+# Исходящие сообщения бота
+class OutboundStatus:
+    Pending = 1
+    Sending = 2
+    Sent = 3
+    Failed = 4
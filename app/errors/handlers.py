@@ -1,12 +1,27 @@
-from flask import redirect, url_for
+from flask import redirect, url_for, flash, request
+from sqlalchemy.orm.exc import StaleDataError
+from app import db
 from app.errors import bp
+from app.api.errors import is_api_request, json_error
 
 
 @bp.app_errorhandler(404)
 def not_found_error(error):
+    if is_api_request():
+        return json_error('Адрес не найден', 404)
     return redirect(url_for('main.index'))
 
 
 @bp.app_errorhandler(500)
 def internal_error(error):
-    return redirect(url_for('main.index'))
\ No newline at end of file
+    if is_api_request():
+        return json_error('Внутренняя ошибка сервера', 500)
+    return redirect(url_for('main.index'))
+
+
+@bp.app_errorhandler(StaleDataError)
+def stale_data_error(error):
+    # Запись успели изменить или удалить, пока форма была открыта (version в app/models.py)
+    db.session.rollback()
+    flash('Запись изменена, обновите страницу')
+    return redirect(request.referrer or url_for('main.index'))
@@ -0,0 +1,39 @@
+import csv
+import io
+from urllib.parse import quote
+from flask import Response, stream_with_context
+from app import app
+
+# Выгрузка в CSV потоком: строки читаются пачками (yield_per, в Postgres это
+# серверный курсор) и сразу уходят клиенту, целиком в памяти ничего не лежит.
+# В запросах только столбцы, без ORM-объектов - сессия их не накапливает.
+
+
+def batches(query):
+    return query.yield_per(app.config['EXPORT_BATCH_SIZE'])
+
+
+def date(value):
+    return value.strftime('%Y-%m-%d %H:%M') if value else ''
+
+
+def generate(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM - чтобы Excel открыл кириллицу как UTF-8
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % app.config['EXPORT_BATCH_SIZE'] == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def csv_response(filename, header, rows):
+    response = Response(stream_with_context(generate(header, rows)),
+                        mimetype='text/csv', content_type='text/csv; charset=utf-8')
+    response.headers['Content-Disposition'] = "attachment; filename*=UTF-8''%s" % quote(filename)
+    return response
@@ -0,0 +1,31 @@
+from flask import get_template_attribute
+from app import app
+from app.cache import LRUCache
+
+# Кэш отрисованных макросов to_html/to_row.
+# Ключ - таблица, id и version записи (увеличивается при каждом изменении через ORM)
+# плюс то, что еще выводит макрос. Изменения связанных записей (имя темы, предмета)
+# видны не позже чем через FRAGMENT_CACHE_TTL секунд.
+
+fragments = LRUCache(app.config['FRAGMENT_CACHE_SIZE'], app.config['FRAGMENT_CACHE_TTL'])
+macros = {}
+
+
+def get_macro(template, name):
+    # При автоперезагрузке шаблонов (debug) макрос не запоминаем
+    if app.jinja_env.auto_reload:
+        return get_template_attribute(template, name)
+
+    macro = macros.get((template, name))
+    if macro is None:
+        macro = macros[(template, name)] = get_template_attribute(template, name)
+    return macro
+
+
+def render_fragment(template, name, key, *args):
+    cache_key = (template, name) + tuple(key)
+    html = fragments.get(cache_key)
+    if html is None:
+        html = get_macro(template, name)(*args)
+        fragments.set(cache_key, html)
+    return html
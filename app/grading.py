@@ -0,0 +1,103 @@
+from datetime import datetime
+from app import db
+from app.models import Student, Theme, DisciplinePointRecord, StudentBalance, group_students
+
+# Оценки сразу для всей группы: пары студент-тема без записи находим одним
+# anti-join, записи добавляем одним INSERT, балансы - UPDATE на каждую сумму.
+# Журнал группы (студенты x темы) - один запрос с группировкой по студенту.
+
+
+def vacant(group_id, theme_ids):
+    # (student_id, theme_id, max_points) для студентов группы, у которых темы еще нет
+    return db.session.query(
+        group_students.c.student_id, Theme.id, Theme.max_points
+    ).select_from(group_students).join(Theme, Theme.id.in_(theme_ids)).outerjoin(
+        DisciplinePointRecord, db.and_(
+            DisciplinePointRecord.student_id == group_students.c.student_id,
+            DisciplinePointRecord.theme_id == Theme.id)
+    ).filter(group_students.c.group_id == group_id, DisciplinePointRecord.id.is_(None))
+
+
+def award(group_id, theme_ids, mentor_id):
+    # Возвращает {student_id: [theme_id]} - что было добавлено, до commit
+    rows = vacant(group_id, list(theme_ids)).all()
+    if not rows:
+        return {}
+
+    timestamp = datetime.utcnow()
+    db.session.execute(DisciplinePointRecord.__table__.insert(), [
+        dict(student_id=student_id, theme_id=theme_id, amount=points,
+             mentor_id=mentor_id, timestamp=timestamp, version=1)
+        for student_id, theme_id, points in rows
+    ])
+
+    awarded = {}
+    points = {}
+    for student_id, theme_id, amount in rows:
+        awarded.setdefault(student_id, []).append(theme_id)
+        points[student_id] = points.get(student_id, 0) + (amount or 0)
+    StudentBalance.change_many(discipline=points)
+    return awarded
+
+
+def pivot(theme_ids):
+    # Строка на студента, столбец theme_<id> на тему: MAX(CASE ...) по записям
+    columns = [db.func.max(db.case([(DisciplinePointRecord.theme_id == theme_id,
+                                     DisciplinePointRecord.amount)])).label('theme_%i' % theme_id)
+               for theme_id in theme_ids]
+    return db.session.query(DisciplinePointRecord.student_id.label('student_id'), *columns).filter(
+        DisciplinePointRecord.theme_id.in_(theme_ids)
+    ).group_by(DisciplinePointRecord.student_id)
+
+
+def grades(student_ids, theme_ids):
+    # Таблица студенты x темы одним запросом. {student_id: {theme_id: amount}}
+    student_ids, theme_ids = list(student_ids), list(theme_ids)
+    if not student_ids or not theme_ids:
+        return {}
+
+    rows = pivot(theme_ids).filter(DisciplinePointRecord.student_id.in_(student_ids))
+    return {row[0]: {theme_id: amount for theme_id, amount in zip(theme_ids, row[1:])
+                     if amount is not None}
+            for row in rows}
+
+
+def gradebook_rows(group_id, theme_ids):
+    # Весь журнал группы: (фамилия, имя, vk_id, баллы по темам...), для выгрузки
+    theme_ids = list(theme_ids)
+    cells = pivot(theme_ids).filter(db.exists().where(db.and_(
+        group_students.c.student_id == DisciplinePointRecord.student_id,
+        group_students.c.group_id == group_id)).correlate(DisciplinePointRecord)).subquery()
+    return db.session.query(
+        Student.last_name, Student.first_name, Student.vk_id,
+        *[cells.c['theme_%i' % theme_id] for theme_id in theme_ids]
+    ).join(group_students, group_students.c.student_id == Student.id).outerjoin(
+        cells, cells.c.student_id == Student.id
+    ).filter(group_students.c.group_id == group_id).order_by(
+        Student.last_name, Student.first_name, Student.id)
+
+
+def regrade(changes, mentor_id):
+    # {(student_id, theme_id): amount} - изменить баллы или добавить запись, до commit
+    if not changes:
+        return
+    student_ids = {student_id for student_id, _ in changes}
+    theme_ids = {theme_id for _, theme_id in changes}
+    records = {(record.student_id, record.theme_id): record
+               for record in DisciplinePointRecord.query.filter(
+                   DisciplinePointRecord.student_id.in_(student_ids),
+                   DisciplinePointRecord.theme_id.in_(theme_ids))}
+
+    points = {}
+    for (student_id, theme_id), amount in changes.items():
+        record = records.get((student_id, theme_id))
+        if record is None:
+            db.session.add(DisciplinePointRecord(student_id=student_id, theme_id=theme_id,
+                                                 mentor_id=mentor_id, amount=amount))
+            difference = amount
+        else:
+            difference = amount - (record.amount or 0)
+            record.amount = amount
+        points[student_id] = points.get(student_id, 0) + difference
+    db.session.flush()
+    StudentBalance.change_many(discipline=points)
@@ -0,0 +1,291 @@
+import csv
+import io
+import os
+from datetime import datetime
+from itertools import islice
+from app import app, db
+from app.models import (Student, Mentor, Theme, Discipline, Order, StudentBalance, ImportProgress,
+                        DisciplinePointRecord, ReferPointRecord, OrderRecord)
+from app.constants import OrderStatus
+from app.utils import chunks
+
+# Загрузка старых записей из CSV (баллы за учебу, приглашения, выданные заказы).
+# Файл читается пачками: студенты ищутся одним IN на пачку, темы, подарки и
+# менторы - один раз. Пачка пишется COPY в Postgres и executemany в остальных
+# базах, балансы ее студентов пересчитываются, номер строки сохраняется в
+# ImportProgress - все в одной транзакции, так что продолжить можно с любого места.
+
+
+class RowError(ValueError):
+    pass
+
+
+class RecordImporter:
+    table = None
+    columns = []
+    required = ['vk_id']
+
+    def __init__(self, mentor_id=None):
+        self.mentor_id = mentor_id
+        self.mentors = {username.lower(): id for id, username in
+                        db.session.query(Mentor.id, Mentor.username)}
+        self.students = {}
+
+    def lookup(self, rows):
+        vk_ids = set()
+        for row in rows:
+            try:
+                vk_ids.add(int(row['vk_id']))
+            except (TypeError, ValueError):
+                pass
+        self.students = {}
+        for chunk in chunks(vk_ids, app.config['BULK_CHUNK_SIZE']):
+            self.students.update(db.session.query(Student.vk_id, Student.id).filter(
+                Student.vk_id.in_(chunk)))
+
+    def process(self, lines):
+        # [(номер строки, строка)] -> записи для вставки, ошибки, число пропущенных
+        self.lookup([row for _, row in lines])
+        records, errors, skipped = [], [], 0
+        for line, row in lines:
+            try:
+                record = self.convert(row)
+            except RowError as error:
+                errors.append((line, str(error)))
+                continue
+            if record is None:
+                skipped += 1
+            else:
+                records.append(record)
+        return records, errors, skipped
+
+    def student(self, row):
+        vk_id = self.number(row, 'vk_id')
+        if vk_id not in self.students:
+            raise RowError('студент vk_id %s не найден' % vk_id)
+        return self.students[vk_id]
+
+    def mentor(self, row):
+        username = (row.get('mentor') or '').strip()
+        if not username:
+            return self.mentor_id
+        if username.lower() not in self.mentors:
+            raise RowError('ментор %s не найден' % username)
+        return self.mentors[username.lower()]
+
+    @staticmethod
+    def number(row, column, default=None):
+        value = (row.get(column) or '').strip()
+        if not value:
+            if default is None:
+                raise RowError('нет значения %s' % column)
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise RowError('%s должно быть числом: %s' % (column, value))
+
+    @classmethod
+    def amount(cls, row, column, default):
+        value = cls.number(row, column, default)
+        if value < 0:
+            raise RowError('%s не может быть отрицательным' % column)
+        return value
+
+    @staticmethod
+    def timestamp(row):
+        value = (row.get('date') or '').strip()
+        if not value:
+            return datetime.utcnow()
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            raise RowError('неверная дата: %s' % value)
+
+
+class DisciplineImporter(RecordImporter):
+    # vk_id, discipline, theme, amount (по умолчанию максимум темы), date, mentor
+    table = DisciplinePointRecord.__table__
+    columns = ['student_id', 'theme_id', 'amount', 'mentor_id', 'timestamp', 'version']
+    required = ['vk_id', 'discipline', 'theme']
+
+    def __init__(self, mentor_id=None):
+        super().__init__(mentor_id)
+        self.themes = {(discipline.lower(), name.lower()): (id, max_points)
+                       for id, name, max_points, discipline in db.session.query(
+                           Theme.id, Theme.name, Theme.max_points, Discipline.name
+                       ).join(Discipline, Discipline.id == Theme.discipline_id)}
+        self.busy = set()
+
+    def lookup(self, rows):
+        super().lookup(rows)
+        # Тема у студента бывает только одна - уже выставленные пропускаем
+        self.busy = set()
+        for chunk in chunks(self.students.values(), app.config['BULK_CHUNK_SIZE']):
+            self.busy.update(db.session.query(
+                DisciplinePointRecord.student_id, DisciplinePointRecord.theme_id
+            ).filter(DisciplinePointRecord.student_id.in_(chunk)))
+
+    def convert(self, row):
+        student_id = self.student(row)
+        key = ((row.get('discipline') or '').strip().lower(), (row.get('theme') or '').strip().lower())
+        if key not in self.themes:
+            raise RowError('тема %s / %s не найдена' % (row.get('discipline'), row.get('theme')))
+        theme_id, max_points = self.themes[key]
+        record = dict(student_id=student_id, theme_id=theme_id,
+                      amount=self.amount(row, 'amount', max_points),
+                      mentor_id=self.mentor(row), timestamp=self.timestamp(row), version=1)
+
+        # Занимаем тему только правильной строкой, иначе следующая для нее же пропадет
+        if (student_id, theme_id) in self.busy:
+            return None
+        self.busy.add((student_id, theme_id))
+        return record
+
+
+class ReferImporter(RecordImporter):
+    # vk_id, refer_vk_id, amount (по умолчанию REFER_RECORD_POINTS), date, mentor
+    table = ReferPointRecord.__table__
+    columns = ['student_id', 'refer_vk_id', 'amount', 'mentor_id', 'timestamp', 'version']
+    required = ['vk_id', 'refer_vk_id']
+
+    def __init__(self, mentor_id=None):
+        super().__init__(mentor_id)
+        self.invited = set()
+
+    def lookup(self, rows):
+        super().lookup(rows)
+        # Приглашенный уникален - уже загруженных пропускаем
+        refer_vk_ids = set()
+        for row in rows:
+            try:
+                refer_vk_ids.add(int(row['refer_vk_id']))
+            except (TypeError, ValueError):
+                pass
+        self.invited = set()
+        for chunk in chunks(refer_vk_ids, app.config['BULK_CHUNK_SIZE']):
+            self.invited.update(refer_vk_id for refer_vk_id, in db.session.query(
+                ReferPointRecord.refer_vk_id).filter(ReferPointRecord.refer_vk_id.in_(chunk)))
+
+    def convert(self, row):
+        student_id = self.student(row)
+        refer_vk_id = self.number(row, 'refer_vk_id')
+        record = dict(student_id=student_id, refer_vk_id=refer_vk_id,
+                      amount=self.amount(row, 'amount', app.config['REFER_RECORD_POINTS']),
+                      mentor_id=self.mentor(row), timestamp=self.timestamp(row), version=1)
+
+        if refer_vk_id in self.invited:
+            return None
+        self.invited.add(refer_vk_id)
+        return record
+
+
+class OrderImporter(RecordImporter):
+    # vk_id, order, cost (по умолчанию стоимость подарка), status (по умолчанию получен),
+    # date, commentary. Повторы не отличить от новых заказов, их не пропускаем
+    table = OrderRecord.__table__
+    columns = ['student_id', 'order_id', 'cost', 'status_id', 'commentary', 'timestamp', 'version']
+    required = ['vk_id', 'order']
+
+    def __init__(self, mentor_id=None):
+        super().__init__(mentor_id)
+        self.orders = {name.lower(): (id, cost) for id, name, cost in
+                       db.session.query(Order.id, Order.name, Order.cost)}
+
+    def convert(self, row):
+        student_id = self.student(row)
+        name = (row.get('order') or '').strip()
+        if name.lower() not in self.orders:
+            raise RowError('подарок %s не найден' % name)
+        order_id, cost = self.orders[name.lower()]
+        status_id = self.number(row, 'status', OrderStatus.Done)
+        if status_id not in [OrderStatus.Ordered, OrderStatus.Sent, OrderStatus.Done]:
+            raise RowError('неверный статус: %s' % status_id)
+
+        return dict(student_id=student_id, order_id=order_id, cost=self.amount(row, 'cost', cost),
+                    status_id=status_id, commentary=(row.get('commentary') or '').strip(),
+                    timestamp=self.timestamp(row), version=1)
+
+
+importers = {
+    'discipline': DisciplineImporter,
+    'refer': ReferImporter,
+    'order': OrderImporter
+}
+
+
+def write(table, columns, records):
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for record in records:
+            writer.writerow([record[column] for column in columns])
+        buffer.seek(0)
+        # Пустое значение без кавычек COPY читает как NULL - строкам оставляем ''
+        text = [column for column in columns if isinstance(table.c[column].type, db.String)]
+        options = 'FORMAT csv' + (', FORCE_NOT_NULL (%s)' % ', '.join(text) if text else '')
+        cursor = connection.connection.cursor()
+        cursor.copy_expert('COPY %s (%s) FROM STDIN WITH (%s)' % (
+            table.name, ', '.join(columns), options), buffer)
+        cursor.close()
+    else:
+        connection.execute(table.insert(), records)
+
+
+def run(kind, path, mentor_id=None, chunk_size=5000, checkpoint=None, restart=False,
+        max_errors=20, log=print):
+    # checkpoint - имя записи ImportProgress, по умолчанию полный путь к файлу
+    name = checkpoint or os.path.abspath(path)
+    progress = ImportProgress.query.get(name)
+    if progress is None:
+        progress = ImportProgress(name=name, kind=kind, rows=0, imported=0, skipped=0,
+                                  errors=0, done=False)
+        db.session.add(progress)
+    elif restart:
+        progress.kind = kind
+        progress.rows = progress.imported = progress.skipped = progress.errors = 0
+        progress.done = False
+    elif progress.kind != kind:
+        raise ValueError('%s уже загружался как %s' % (name, progress.kind))
+    elif progress.done:
+        raise ValueError('файл уже загружен, для повторной загрузки укажите --restart')
+    elif progress.rows:
+        log('Продолжаем со строки %i' % (progress.rows + 2))
+
+    importer = importers[kind](mentor_id)
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        reader = csv.DictReader(file)
+        missing = [column for column in importer.required if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError('в файле нет столбцов: %s' % ', '.join(missing))
+
+        # Строка 1 - заголовок
+        lines = enumerate(reader, 2)
+        for _ in islice(lines, progress.rows):
+            pass
+
+        while True:
+            chunk = list(islice(lines, chunk_size))
+            if not chunk:
+                break
+
+            records, errors, skipped = importer.process(chunk)
+            if records:
+                write(importer.table, importer.columns, records)
+                StudentBalance.recalculate({record['student_id'] for record in records})
+
+            for line, message in errors:
+                if progress.errors < max_errors:
+                    log('Строка %i: %s' % (line, message))
+                progress.errors += 1
+            progress.rows += len(chunk)
+            progress.imported += len(records)
+            progress.skipped += skipped
+            db.session.commit()
+            log('Строк: %i, добавлено: %i, пропущено: %i, ошибок: %i' % (
+                progress.rows, progress.imported, progress.skipped, progress.errors))
+
+    progress.done = True
+    db.session.commit()
+    return progress
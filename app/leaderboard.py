@@ -0,0 +1,76 @@
+from app import db
+from app.models import Student, StudentBalance, Group, group_students
+
+# Рейтинг студентов по сумме баллов в группе, предмете или всей школе.
+# Места считаются оконными функциями по student_balance.total, который
+# обновляется вместе с записями (StudentBalance.change) и проиндексирован.
+
+
+def members(query, group_id=None, discipline_id=None):
+    if group_id is not None:
+        return query.filter(db.exists().where(db.and_(
+            group_students.c.student_id == StudentBalance.student_id,
+            group_students.c.group_id == group_id)).correlate(StudentBalance))
+    if discipline_id is not None:
+        return query.filter(db.exists().where(db.and_(
+            group_students.c.student_id == StudentBalance.student_id,
+            Group.id == group_students.c.group_id,
+            Group.discipline_id == discipline_id)).correlate(StudentBalance))
+    return query
+
+
+def ranking(group_id=None, discipline_id=None):
+    # place - место с учетом равенства баллов (1, 2, 2, 4), position - порядок вывода
+    query = db.session.query(
+        StudentBalance.student_id.label('student_id'),
+        StudentBalance.total.label('total'),
+        db.func.rank().over(order_by=StudentBalance.total.desc()).label('place'),
+        db.func.row_number().over(order_by=[StudentBalance.total.desc(), Student.last_name,
+                                            Student.first_name, Student.id]).label('position')
+    ).join(Student, Student.id == StudentBalance.student_id)
+    return members(query, group_id, discipline_id).subquery()
+
+
+def board(group_id=None, discipline_id=None):
+    ranks = ranking(group_id, discipline_id)
+    return db.session.query(Student, ranks.c.place, ranks.c.total).join(
+        ranks, ranks.c.student_id == Student.id
+    ).order_by(ranks.c.position)
+
+
+def position(student_id, group_id=None, discipline_id=None):
+    ranks = ranking(group_id, discipline_id)
+    return db.session.query(ranks.c.position).filter(ranks.c.student_id == student_id).scalar()
+
+
+def place(student, group_id=None, discipline_id=None):
+    # Место одного студента без сортировки всех: 1 + число студентов с большим счетом
+    total = student.get_balance().total
+    higher, size = members(db.session.query(
+        db.func.coalesce(db.func.sum(db.case([(StudentBalance.total > total, 1)], else_=0)), 0),
+        db.func.count(StudentBalance.student_id)
+    ), group_id, discipline_id).one()
+    return higher + 1, size
+
+
+def group_places(student, groups):
+    # {group_id: (место, всего)} во всех группах студента одним запросом:
+    # rank() по каждой группе отдельно, затем строка самого студента
+    group_ids = [group.id for group in groups]
+    if not group_ids:
+        return {}
+    ranks = db.session.query(
+        group_students.c.group_id.label('group_id'),
+        group_students.c.student_id.label('student_id'),
+        db.func.rank().over(partition_by=group_students.c.group_id,
+                            order_by=StudentBalance.total.desc()).label('place'),
+        db.func.count().over(partition_by=group_students.c.group_id).label('size')
+    ).join(StudentBalance, StudentBalance.student_id == group_students.c.student_id).filter(
+        group_students.c.group_id.in_(group_ids)).subquery()
+    result = {group_id: (place, size) for group_id, place, size in db.session.query(
+        ranks.c.group_id, ranks.c.place, ranks.c.size).filter(ranks.c.student_id == student.id)}
+    # Без сохраненного баланса студента в окне нет - считаем как раньше
+    for group_id in group_ids:
+        if group_id not in result:
+            result[group_id] = place(student, group_id=group_id)
+    return result
@@ -0,0 +1,48 @@
+from flask_login import current_user
+from app import db
+from app.access import scope
+from app.constants import Access
+from app.models import (Mentor, Theme, Discipline, DisciplinePointRecord, ReferPointRecord,
+                        OrderRecord, Order)
+
+# Все записи студента (учеба, приглашения, заказы) одним UNION ALL с общими
+# столбцами. Каждый видит только те таблицы, что и на страницах студента:
+# учеба - не ястреб и в своем предмете, приглашения - от ястреба, заказы - от ангела.
+
+kinds = ['discipline', 'refer', 'order']
+
+
+def entries(student_id):
+    # Подзапрос со столбцами kind, id, version, timestamp, description, amount, mentor, commentary
+    mentor = (Mentor.last_name + ' ' + Mentor.first_name).label('mentor')
+
+    parts = []
+    if current_user.access_level != Access.HAWK:
+        parts.append(scope().discipline_records(db.session.query(
+            db.literal('discipline').label('kind'), DisciplinePointRecord.id.label('id'),
+            DisciplinePointRecord.version.label('version'),
+            DisciplinePointRecord.timestamp.label('timestamp'),
+            (Discipline.name + ' ' + Theme.name).label('description'),
+            DisciplinePointRecord.amount.label('amount'), mentor, db.literal('').label('commentary')
+        )).join(Theme, Theme.id == DisciplinePointRecord.theme_id).join(
+            Discipline, Discipline.id == Theme.discipline_id
+        ).outerjoin(Mentor, Mentor.id == DisciplinePointRecord.mentor_id).filter(
+            DisciplinePointRecord.student_id == student_id))
+    if current_user.access_level >= Access.HAWK:
+        parts.append(db.session.query(
+            db.literal('refer').label('kind'), ReferPointRecord.id.label('id'),
+            ReferPointRecord.version.label('version'), ReferPointRecord.timestamp.label('timestamp'),
+            ('vk.com/id' + db.cast(ReferPointRecord.refer_vk_id, db.String)).label('description'),
+            ReferPointRecord.amount.label('amount'), mentor, db.literal('').label('commentary')
+        ).outerjoin(Mentor, Mentor.id == ReferPointRecord.mentor_id).filter(
+            ReferPointRecord.student_id == student_id))
+    if current_user.access_level >= Access.ANGEL:
+        parts.append(db.session.query(
+            db.literal('order').label('kind'), OrderRecord.id.label('id'),
+            OrderRecord.version.label('version'), OrderRecord.timestamp.label('timestamp'),
+            Order.name.label('description'), (-OrderRecord.cost).label('amount'),
+            db.literal('').label('mentor'), OrderRecord.commentary.label('commentary')
+        ).join(Order, Order.id == OrderRecord.order_id).filter(
+            OrderRecord.student_id == student_id))
+
+    return db.union_all(*[part.statement for part in parts]).alias('ledger')
@@ -1,7 +1,9 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, IntegerField, SubmitField, SelectField, RadioField
+from wtforms import StringField, IntegerField, SubmitField, SelectField, SelectMultipleField, RadioField
 from wtforms.validators import ValidationError, DataRequired
-from app.models import Group, Discipline, ReferPointRecord, Order, OrderRecord
+from app import choices
+from app.models import Group, ReferPointRecord, Order, OrderRecord
+from app.constants import OrderStatus
 
 
 class GroupForm(FlaskForm):
@@ -12,8 +14,7 @@ class GroupForm(FlaskForm):
     def __init__(self, group_name='', *args, **kwargs):
         super(GroupForm, self).__init__(*args, **kwargs)
         self.group_name = group_name
-        self.disciplines.choices = [(t.id, t.name)
-                                    for t in Discipline.query.order_by(Discipline.name).all()]
+        self.disciplines.choices = choices.disciplines()
 
     def validate_name(self, name):
         if self.group_name != name.data:
@@ -37,12 +38,28 @@ class DisciplineRecordForm(FlaskForm):
     themes = SelectField('Тема', validators=[DataRequired()], coerce=int)
     submit = SubmitField('Добавить')
 
-    def __init__(self, themes, *args, **kwargs):
+    def __init__(self, theme_ids, *args, **kwargs):
         super(DisciplineRecordForm, self).__init__(*args, **kwargs)
-        self.themes.choices = [(theme.id, theme.discipline.name + ' ' + theme.name)
+        labels = choices.theme_labels()
+        self.themes.choices = [(theme_id, labels[theme_id]) for theme_id in theme_ids
+                               if theme_id in labels]
+
+
+class GroupGradeForm(FlaskForm):
+    themes = SelectMultipleField('Темы', validators=[DataRequired()], coerce=int)
+    submit = SubmitField('Выставить всей группе')
+
+    def __init__(self, themes, *args, **kwargs):
+        super(GroupGradeForm, self).__init__(*args, **kwargs)
+        self.themes.choices = [(theme.id, '%s (%s)' % (theme.name, theme.max_points))
                                for theme in themes]
 
 
+class GradebookForm(FlaskForm):
+    # Сами ячейки - поля cell-<student_id>-<theme_id>, их число зависит от страницы
+    submit = SubmitField('Сохранить')
+
+
 class ReferRecordForm(FlaskForm):
     referal = IntegerField('Приглашенный', validators=[DataRequired(message="Значение должно быть числом")])
     submit = SubmitField('Добавить')
@@ -68,11 +85,9 @@ class OrderRecordForm(FlaskForm):
     def __init__(self, student, *args, **kwargs):
         super(OrderRecordForm, self).__init__(*args, **kwargs)
         self._student = student
-        busy_orders = student.order_records.with_entities(OrderRecord.order_id)
-        self.orders.choices = [(t.id, "Стоимость: " + str(t.cost) + " " + t.name)
-                               for t in Order.query.filter(
-                Order.id.notin_(busy_orders)
-            ).order_by(Order.id).all()]
+        busy_orders = {order_id for order_id, in student.order_records.with_entities(OrderRecord.order_id)}
+        self.orders.choices = [(id, "Стоимость: " + str(cost) + " " + name)
+                               for id, name, cost in choices.orders() if id not in busy_orders]
 
 
 class OrderForm(FlaskForm):
@@ -86,3 +101,9 @@ class OrderForm(FlaskForm):
         order = Order.query.filter_by(name=self.name.data).first()
         if order is not None:
             raise ValidationError("Подарок с таким названием уже существует")
+
+
+class OrderStatusForm(FlaskForm):
+    status = SelectField('Перевести выбранные в статус', coerce=int,
+                         choices=[(OrderStatus.Sent, 'Отправлен'), (OrderStatus.Done, 'Получен')])
+    submit = SubmitField('Изменить')
@@ -0,0 +1,53 @@
+from collections import namedtuple, defaultdict
+from app import db
+from app.fragments import render_fragment
+from app.models import Student, group_students
+
+
+class StudentRow(namedtuple('StudentRow', ['id', 'first_name', 'last_name', 'vk_id'])):
+    @property
+    def username(self):
+        return self.last_name + ' ' + self.first_name
+
+
+# Данные группы для шаблона, без ленивых запросов при отрисовке
+class GroupView:
+    def __init__(self, group, students, balances):
+        self.id = group.id
+        self.version = group.version
+        self.name = group.name
+        self.discipline_name = group.discipline_name
+        self.students = students
+        self.balances = balances
+
+    def to_html(self):
+        key = ('group', self.id, self.version, self.discipline_name,
+               tuple((student, self.balances[student.id]) for student in self.students))
+        return render_fragment('main/_group.html', 'render', key, self, self.students, self.balances)
+
+
+def group_rosters(group_ids):
+    # {group_id: [StudentRow]} одним запросом, отсортировано по фамилии
+    rosters = defaultdict(list)
+    if not group_ids:
+        return rosters
+
+    rows = db.session.query(
+        group_students.c.group_id, Student.id, Student.first_name, Student.last_name, Student.vk_id
+    ).join(
+        Student, Student.id == group_students.c.student_id
+    ).filter(
+        group_students.c.group_id.in_(group_ids)
+    ).order_by(Student.last_name, Student.first_name)
+
+    for group_id, *student in rows:
+        rosters[group_id].append(StudentRow(*student))
+    return rosters
+
+
+def prefetch_groups(groups):
+    # Группы должны быть загружены вместе с предметом (joinedload)
+    rosters = group_rosters([group.id for group in groups])
+    balances = Student.balances(student.id
+                                for roster in rosters.values() for student in roster)
+    return [GroupView(group, rosters[group.id], balances) for group in groups]
@@ -1,15 +1,24 @@
-from flask import render_template, flash, redirect, url_for, g, request
+from flask import render_template, flash, redirect, url_for, g, request, jsonify
 from flask_login import current_user, login_required
 from werkzeug.urls import url_parse
 from app import app, db
-from app.models import (Student, Group, Theme, DisciplinePointRecord, ReferPointRecord,
-                        OrderRecord, Order)
+from app.models import (Student, Group, Theme, Discipline, DisciplinePointRecord, ReferPointRecord,
+                        OrderRecord, Order, StudentBalance)
 from app.main import bp
-from app.main.forms import (GroupForm, ChangeGroupForm, DisciplineRecordForm,
-                            ReferRecordForm, OrderRecordForm, OrderForm)
-from app.constants import Access, navs, OrderStatus
+from app.main.prefetch import prefetch_groups
+from app.access import scope
+from app.choices import search_groups
+from app.export import batches, csv_response, date
+from app.grading import award, grades, gradebook_rows, regrade
+from app.leaderboard import board, position
+from app.ledger import entries
+from app.pagination import paginate
+from app.main.forms import (GroupForm, ChangeGroupForm, DisciplineRecordForm, GroupGradeForm,
+                            GradebookForm, ReferRecordForm, OrderRecordForm, OrderForm, OrderStatusForm)
+from app.constants import Access, navs, Orders, OrderStatus
+from app.students.importer import import_students
 from app.utils import (admin_required, angel_required, get_group, get_student, is_admin,
-                       get_discipline_records, get_vk_users_data)
+                       get_discipline_records, get_vk_users_data, parse_vk_ids)
 
 
 @bp.before_app_request
@@ -30,14 +39,9 @@ def index():
 @bp.route('/order/list', methods=['GET', 'POST'])
 @angel_required
 def order_list():
-    page = request.args.get('page', 1, type=int)
-
-    orders = Order.query.order_by(
-        Order.name
-    )
-    orders = orders.paginate(
-        page, app.config['GROUPS_PER_PAGE'], False
-    )
+    orders = paginate(Order.query, [(Order.name, False), (Order.id, False)],
+                      app.config['GROUPS_PER_PAGE'])
+    g.url_for = 'main.order_list'
     if current_user.access_level == Access.ANGEL:
         return render_template('data_list.html',
                                title='Список подарков', data=orders)
@@ -67,6 +71,61 @@ def order(order_id):
     return render_template('main/order_page.html', order=current_order)
 
 
+@bp.route('/order/queue', methods=['GET', 'POST'])
+@angel_required
+def order_queue():
+    # Заказы всех подарков с фильтрами, статус меняется сразу у выбранных
+    form = OrderStatusForm()
+    if form.validate_on_submit():
+        record_ids = request.form.getlist('record_id', type=int)
+        updated = OrderRecord.advance(record_ids, form.status.data)
+        db.session.commit()
+        flash('Статус изменен у заказов: %i' % updated)
+        return redirect(request.full_path)
+
+    records, args = queue_filters(OrderRecord.query.join(Order, Order.id == OrderRecord.order_id).options(
+        db.contains_eager(OrderRecord.order), db.joinedload(OrderRecord.student)))
+    records = paginate(records, OrderRecord.page_keys(), app.config['RECORDS_PER_PAGE'])
+
+    return render_template('main/order_queue.html', title='Выдача подарков', form=form,
+                           data=records, args=args, orders=Order.query.order_by(Order.name).all())
+
+
+@bp.route('/order/queue.csv')
+@angel_required
+def order_queue_export():
+    query, _ = queue_filters(db.session.query(
+        OrderRecord.timestamp, Student.last_name, Student.first_name, Student.vk_id, Order.name,
+        Order.type_id, OrderRecord.cost, OrderRecord.status_id, OrderRecord.commentary
+    ).join(Order, Order.id == OrderRecord.order_id).join(Student, Student.id == OrderRecord.student_id))
+    query = query.order_by(OrderRecord.timestamp, OrderRecord.id)
+
+    rows = ((date(timestamp), last_name + ' ' + first_name, vk_id, name, cost,
+             Orders.status(type_id, status_id), commentary)
+            for timestamp, last_name, first_name, vk_id, name, type_id, cost, status_id, commentary
+            in batches(query))
+    return csv_response('orders.csv', ['Дата', 'Студент', 'Вконтакте', 'Подарок', 'Стоимость',
+                                       'Статус', 'Комментарий'], rows)
+
+
+def queue_filters(query):
+    # Фильтры очереди заказов из строки запроса - общие для страницы и выгрузки
+    order_id = request.args.get('order_id', type=int)
+    type_id = request.args.get('type_id', type=int)
+    status_id = request.args.get('status_id', OrderStatus.Ordered, type=int)
+
+    if order_id:
+        query = query.filter(OrderRecord.order_id == order_id)
+    if type_id:
+        query = query.filter(Order.type_id == type_id)
+    if status_id:
+        query = query.filter(OrderRecord.status_id == status_id)
+
+    args = {key: value for key, value in dict(order_id=order_id, type_id=type_id,
+                                              status_id=status_id).items() if value is not None}
+    return query, args
+
+
 @bp.route('/order/remove/<order_id>')
 @admin_required
 def remove_order(order_id):
@@ -89,7 +148,6 @@ def group_list():
     if current_user.access_level == Access.HAWK:
         return redirect(url_for('main.student_list'))
 
-    page = request.args.get('page', 1, type=int)
     form = None
     if is_admin(current_user):
         form = GroupForm()
@@ -100,20 +158,12 @@ def group_list():
             db.session.add(new_group)
             db.session.commit()
             flash('Группа %s добавлена' % new_group.name)
-            return redirect(url_for('main.group_list', page=page))
-
-    groups = Group.query.order_by(
-        Group.name
-    )
-    if current_user.access_level == Access.UP_MENTOR:
-        groups = groups.filter_by(discipline_id=current_user.discipline_id)
-
-    if current_user.access_level == Access.MENTOR:
-        groups = current_user.groups
+            return redirect(url_for('main.group_list'))
 
-    groups = groups.paginate(
-        page, app.config['GROUPS_PER_PAGE'], False
-    )
+    groups = paginate(scope().groups().options(db.joinedload(Group.discipline)),
+                      [(Group.name, False), (Group.id, False)],
+                      app.config['GROUPS_PER_PAGE'])
+    groups.items = prefetch_groups(groups.items)
     g.url_for = 'main.group_list'
 
     return render_template('data_list.html', form=form,
@@ -124,9 +174,6 @@ def group_list():
 @login_required
 def group(group_id):
     current_group = get_group(group_id)
-    if current_user.access_level in [Access.MENTOR, Access.UP_MENTOR] and \
-            current_user.discipline_id != current_group.discipline_id:
-        return redirect(url_for('main.index'))
 
     form = None
     if is_admin(current_user):
@@ -140,8 +187,168 @@ def group(group_id):
 
             return redirect(url_for('main.group', group_id=current_group.id))
 
+    students = current_group.sorted_students()
+    balances = Student.balances(student.id for student in students)
+
     return render_template('main/group_page.html', form=form,
-                           group=current_group, title=current_group.name)
+                           group=current_group, title=current_group.name,
+                           students=students, balances=balances)
+
+
+@bp.route('/typeahead/groups')
+@login_required
+def typeahead_groups():
+    # Подсказки для TypeaheadField: группы по части названия, страницами
+    return jsonify(search_groups(scope().groups(), request.args.get('q', '').strip(),
+                                 request.args.get('cursor'),
+                                 discipline_id=request.args.get('discipline_id', type=int),
+                                 student_id=request.args.get('student_id', type=int),
+                                 mentor_id=request.args.get('mentor_id', type=int)))
+
+
+@bp.route('/group/<group_id>/grade', methods=['GET', 'POST'])
+@login_required
+def group_grade(group_id):
+    # Темы сразу всем студентам группы, у кого их еще нет
+    if current_user.access_level == Access.HAWK:
+        flash("У вас недостаточно прав для просмота данной страницы")
+        return redirect(url_for('main.index'))
+
+    current_group = get_group(group_id)
+    themes = scope().themes().filter(
+        Theme.discipline_id == current_group.discipline_id
+    ).order_by(Theme.name).all()
+    form = GroupGradeForm(themes)
+
+    results = None
+    if form.validate_on_submit():
+        awarded = award(current_group.id, form.themes.data, current_user.id)
+        db.session.commit()
+
+        names = {theme.id: theme.name for theme in themes}
+        results = [(student, [names[theme_id] for theme_id in awarded.get(student.id, [])],
+                    [names[theme_id] for theme_id in form.themes.data
+                     if theme_id not in awarded.get(student.id, [])])
+                   for student in current_group.sorted_students()]
+        flash('Добавлено записей: %i' % sum(len(theme_ids) for theme_ids in awarded.values()))
+
+    return render_template('main/group_grade.html', form=form, group=current_group,
+                           title='Оценки группы %s' % current_group.name, results=results)
+
+
+@bp.route('/group/<group_id>/gradebook', methods=['GET', 'POST'])
+@login_required
+def gradebook(group_id):
+    # Журнал группы: студенты x темы предмета, баллы можно править прямо в таблице
+    if current_user.access_level == Access.HAWK:
+        flash("У вас недостаточно прав для просмота данной страницы")
+        return redirect(url_for('main.index'))
+
+    current_group = get_group(group_id)
+    themes = scope().themes().filter(
+        Theme.discipline_id == current_group.discipline_id
+    ).order_by(Theme.name, Theme.id).all()
+    students = paginate(current_group.students, [(Student.last_name, False),
+                                                 (Student.first_name, False), (Student.id, False)],
+                        app.config['STUDENTS_PER_PAGE'])
+    cells = grades([student.id for student in students.items], [theme.id for theme in themes])
+
+    form = GradebookForm()
+    if form.validate_on_submit():
+        changes = {}
+        errors = 0
+        conflicts = 0
+        for student in students.items:
+            for theme in themes:
+                key = '%i-%i' % (student.id, theme.id)
+                value = request.form.get('cell-' + key, '').strip()
+                # was-<ключ> - значение, которое было на странице при открытии
+                shown = request.form.get('was-' + key, '')
+                if not value or value == shown:
+                    continue
+                try:
+                    amount = int(value)
+                except ValueError:
+                    errors += 1
+                    continue
+                current = cells.get(student.id, {}).get(theme.id)
+                if not 0 <= amount <= theme.max_points:
+                    errors += 1
+                elif shown != ('' if current is None else str(current)):
+                    # Балл успели изменить с другой страницы - не перезаписываем
+                    conflicts += 1
+                elif amount != current:
+                    changes[(student.id, theme.id)] = amount
+
+        regrade(changes, current_user.id)
+        db.session.commit()
+        flash('Изменено ячеек: %i' % len(changes))
+        if errors:
+            flash('Пропущено неверных значений: %i' % errors)
+        if conflicts:
+            flash('Не сохранено ячеек, измененных другими после открытия страницы: %i' % conflicts)
+        return redirect(request.full_path)
+
+    return render_template('main/gradebook.html', form=form, group=current_group,
+                           title='Журнал группы %s' % current_group.name, themes=themes,
+                           students=students, cells=cells)
+
+
+@bp.route('/group/<group_id>/gradebook.csv')
+@login_required
+def gradebook_export(group_id):
+    if current_user.access_level == Access.HAWK:
+        flash("У вас недостаточно прав для просмота данной страницы")
+        return redirect(url_for('main.index'))
+
+    current_group = get_group(group_id)
+    themes = scope().themes().filter(
+        Theme.discipline_id == current_group.discipline_id
+    ).order_by(Theme.name, Theme.id).all()
+
+    rows = ((last_name + ' ' + first_name, vk_id) + tuple(amounts) +
+            (sum(amount for amount in amounts if amount),)
+            for last_name, first_name, vk_id, *amounts
+            in batches(gradebook_rows(current_group.id, [theme.id for theme in themes])))
+    return csv_response('%s.csv' % current_group.name,
+                        ['Студент', 'Вконтакте'] + [theme.name for theme in themes] + ['Всего'],
+                        rows)
+
+
+@bp.route('/leaderboard')
+@bp.route('/leaderboard/group/<group_id>')
+@bp.route('/leaderboard/discipline/<discipline_id>')
+@login_required
+def leaderboard(group_id=None, discipline_id=None):
+    if group_id is not None:
+        title = 'Рейтинг группы %s' % get_group(group_id).name
+        args = dict(group_id=group_id)
+    elif current_user.access_level == Access.MENTOR:
+        # Наставник видит только студентов своих групп
+        return redirect(url_for('main.group_list'))
+    elif discipline_id is not None:
+        discipline = scope().disciplines().filter(Discipline.id == discipline_id).first_or_404()
+        title = 'Рейтинг по предмету %s' % discipline.name
+        args = dict(discipline_id=discipline_id)
+    elif current_user.access_level == Access.UP_MENTOR:
+        return redirect(url_for('main.group_list'))
+    else:
+        title = 'Рейтинг школы'
+        args = {}
+
+    per_page = app.config['STUDENTS_PER_PAGE']
+    page = request.args.get('page', 1, type=int)
+    # Страница, на которой находится студент
+    student_id = request.args.get('student', type=int)
+    if student_id is not None:
+        found = position(student_id, group_id, discipline_id)
+        if found is not None:
+            page = (found - 1) // per_page + 1
+
+    rows = board(group_id, discipline_id).paginate(page, per_page, False)
+
+    return render_template('main/leaderboard.html', title=title, data=rows,
+                           args=args, student_id=student_id)
 
 
 @bp.route('/group/remove/<group_id>')
@@ -159,30 +366,16 @@ def remove_group(group_id):
 @bp.route('/group/id/<group_id>/add_multiple', methods=['POST'])
 @login_required
 def group_add_students(group_id):
-    r_form = request.form
-
-    users = get_vk_users_data(r_form)
-    students = []
-    for user in users:
-        student = Student.query.filter_by(vk_id=user['id']).first()
-        if student is None:
-            student = Student(first_name=user['first_name'],
-                              last_name=user['last_name'],
-                              vk_id=user['id'])
-            db.session.add(student)
-            flash("Студент %s vk_id: %i Добавлен в базу" % (student.username, student.vk_id))
-        students.append(student)
-
     group = get_group(group_id)
-    for student in students:
-        if student.is_in_group(group):
-            flash("Студент %s vk_id: %i уже состоит в данной группе" % (student.username, student.vk_id))
-        else:
-            student.add_group(group)
-            flash("Студент %s vk_id: %i Добавлен в группу" % (student.username, student.vk_id))
+    ids = parse_vk_ids(request.form)
+    if ids is None:
+        flash('Проверьте правильность id')
+        return redirect(url_for('main.group', group_id=group_id))
 
+    report = import_students(ids, get_vk_users_data(ids), current_user, group)
     db.session.commit()
-    return redirect(url_for('main.group', group_id=group_id))
+
+    return redirect(url_for('students.import_report', report_id=report.id))
 
 
 @bp.route('/group/id/<group_id>/remove/<student_id>')
@@ -198,38 +391,30 @@ def remove_user(group_id, student_id):
 @bp.route('/table/discipline/<student_id>', methods=['GET', 'POST'])
 @login_required
 def disc_table(student_id):
-    current_student = get_student(student_id)
-
-    if current_user.access_level == Access.MENTOR:
-        m_gr = set(current_user.groups)
-        s_gr = set(current_student.groups)
-        if not m_gr & s_gr:
-            flash("У вас недостаточно прав для просмота данной страницы")
-            return redirect(url_for('main.index'))
-
+    # Студенты чужих групп для наставника не найдутся, см. app/access.py
     if current_user.access_level == Access.HAWK:
         flash("У вас недостаточно прав для просмота данной страницы")
         return redirect(url_for('main.index'))
 
+    current_student = get_student(student_id)
     student_disc = current_student.groups.with_entities(Group.discipline_id)
     busy_theme = current_student.discipline_records.with_entities(
         DisciplinePointRecord.theme_id
     )
-    vacant_theme = Theme.query.filter(
+    vacant_theme = scope().themes().filter(
         Theme.id.notin_(busy_theme)).filter(
         Theme.discipline_id.in_(student_disc)
-    )
-
-    if current_user.access_level in [Access.MENTOR, Access.UP_MENTOR]:
-        vacant_theme = vacant_theme.filter_by(discipline=current_user.discipline)
-
-    vacant_theme = vacant_theme.order_by(
+    ).order_by(
         Theme.name
     )
 
-    form = DisciplineRecordForm(vacant_theme)
-    records = get_discipline_records(current_student).all()
-    records = sorted(records, key=lambda x: (x.theme.discipline.name, x.theme.name))
+    form = DisciplineRecordForm(theme_id for theme_id, in vacant_theme.with_entities(Theme.id))
+    records = get_discipline_records(current_student).join(
+        Theme, Theme.id == DisciplinePointRecord.theme_id
+    ).join(Discipline, Discipline.id == Theme.discipline_id).options(
+        db.contains_eager(DisciplinePointRecord.theme).contains_eager(Theme.discipline),
+        db.joinedload(DisciplinePointRecord.mentor)
+    ).order_by(Discipline.name, Theme.name).all()
 
     if form.validate_on_submit():
         theme = Theme.query.get(form.themes.data)
@@ -238,6 +423,7 @@ def disc_table(student_id):
                                         student_id=current_student.id)
         new_rec.amount = theme.max_points
         db.session.add(new_rec)
+        StudentBalance.change(current_student.id, discipline=new_rec.amount)
         db.session.commit()
 
         flash("Запись добавлена")
@@ -250,6 +436,23 @@ def disc_table(student_id):
                                  current_student.username])
 
 
+@bp.route('/table/ledger/<student_id>.csv')
+@login_required
+def ledger_export(student_id):
+    current_student = get_student(student_id)
+    ledger = entries(current_student.id)
+    query = db.session.query(
+        ledger.c.kind, ledger.c.timestamp, ledger.c.description, ledger.c.amount,
+        ledger.c.mentor, ledger.c.commentary
+    ).order_by(ledger.c.timestamp, ledger.c.kind, ledger.c.id)
+
+    names = dict(discipline='Учеба', refer='Приглашение', order='Заказ')
+    rows = ((names[kind], date(timestamp), description, amount, mentor, commentary)
+            for kind, timestamp, description, amount, mentor, commentary in batches(query))
+    return csv_response('%s.csv' % current_student.username,
+                        ['Тип', 'Дата', 'Описание', 'Баллы', 'Ментор', 'Комментарий'], rows)
+
+
 @bp.route('/table/referal/<student_id>', methods=['GET', 'POST'])
 @login_required
 def refer_table(student_id):
@@ -270,6 +473,7 @@ def refer_table(student_id):
                                    mentor_id=current_user.id)
 
         db.session.add(new_rec)
+        StudentBalance.change(current_student.id, refer=new_rec.amount)
         db.session.commit()
         flash("Запись добавлена")
         return redirect(url_for('main.refer_table', student_id=student_id))
@@ -296,7 +500,7 @@ def order_table(student_id):
 
     if form.validate_on_submit():
         order = Order.query.get(form.orders.data)
-        if current_student.total_points() < order.cost:
+        if not StudentBalance.spend(current_student.id, order.cost):
             flash("У данного студента недостаточно баллов")
         else:
             new_rec = OrderRecord(cost=order.cost,
@@ -326,15 +530,12 @@ def done_order_by_set(order_id):
 
     order = Order.query.get(order_id)
 
-    page = request.args.get('page', 1, type=int)
-    records = OrderRecord.query.filter_by(order_id=order_id, status_id=OrderStatus.Done)
-    records = records.paginate(
-        page, app.config['RECORDS_PER_PAGE'], False
-    )
+    records = OrderRecord.query.filter_by(order_id=order_id, status_id=OrderStatus.Done).options(
+        db.joinedload(OrderRecord.student), db.joinedload(OrderRecord.order))
+    records = paginate(records, OrderRecord.page_keys(), app.config['RECORDS_PER_PAGE'])
 
     return render_template('main/table.html', title=order.name,
-                           records=records.items, type=OrderRecord,
-                           page=records.page, pages=records.pages)
+                           records=records.items, type=OrderRecord, data=records)
 
 
 @bp.route('/table/orders/by_set/ordered/<order_id>')
@@ -346,15 +547,12 @@ def ordered_order_by_set(order_id):
 
     order = Order.query.get(order_id)
 
-    page = request.args.get('page', 1, type=int)
-    records = OrderRecord.query.filter_by(order_id=order_id, status_id=OrderStatus.Ordered)
-    records = records.paginate(
-        page, app.config['RECORDS_PER_PAGE'], False
-    )
+    records = OrderRecord.query.filter_by(order_id=order_id, status_id=OrderStatus.Ordered).options(
+        db.joinedload(OrderRecord.student), db.joinedload(OrderRecord.order))
+    records = paginate(records, OrderRecord.page_keys(), app.config['RECORDS_PER_PAGE'])
 
     return render_template('main/table.html', title=order.name,
-                           records=records.items, type=OrderRecord,
-                           page=records.page, pages=records.pages)
+                           records=records.items, type=OrderRecord, data=records)
 
 
 @bp.route('/order_record/set_done/<record_id>')
@@ -380,6 +578,7 @@ def delete_order_record(record_id):
     student_id = record.student_id
 
     db.session.delete(record)
+    StudentBalance.change(student_id, spent=-record.cost)
     db.session.commit()
 
     flash("Заказ успешно удален")
@@ -396,6 +595,7 @@ def delete_discipline_record(record_id):
     student_id = record.student_id
 
     db.session.delete(record)
+    StudentBalance.change(student_id, discipline=-record.amount)
     db.session.commit()
 
     flash("Запись успешно удалена")
@@ -412,6 +612,7 @@ def delete_refer_record(record_id):
     student_id = record.student_id
 
     db.session.delete(record)
+    StudentBalance.change(student_id, refer=-record.amount)
     db.session.commit()
 
     flash("Запись успешно удалена")
@@ -1,33 +1,44 @@
-from datetime import datetime
-from flask import get_template_attribute, url_for
+import json
+from collections import namedtuple
+from datetime import datetime, timedelta
+from flask import url_for
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-from app import db, login
-from app.constants import Access, access_desc, default_message, Orders
+from sqlalchemy.exc import IntegrityError
+from vk_api.utils import get_random_id
+from app import app, db, login
+from app.cache import LRUCache
+from app.fragments import render_fragment
+from app.passwords import hash_password, verify_password, needs_rehash
+from app.constants import Access, access_desc, default_message, Orders, OutboundStatus
 
 
 group_mentors = db.Table(
     'group_mentors',
-    db.Column('group_id', db.Integer, db.ForeignKey('group.id')),
-    db.Column('mentor_id', db.Integer, db.ForeignKey('mentor.id'))
+    db.Column('group_id', db.Integer, db.ForeignKey('group.id'), primary_key=True),
+    db.Column('mentor_id', db.Integer, db.ForeignKey('mentor.id'), primary_key=True),
+    db.Index('ix_group_mentors_mentor_id', 'mentor_id', 'group_id')
 )
 
 group_students = db.Table(
     'group_students',
-    db.Column('student_id', db.Integer, db.ForeignKey('student.id')),
-    db.Column('group_id', db.Integer, db.ForeignKey('group.id'))
+    db.Column('group_id', db.Integer, db.ForeignKey('group.id'), primary_key=True),
+    db.Column('student_id', db.Integer, db.ForeignKey('student.id'), primary_key=True),
+    db.Index('ix_group_students_student_id', 'student_id', 'group_id')
 )
 
 
 class Mentor(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    # Увеличивается ORM при каждом UPDATE, см. app/fragments.py
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {'version_id_col': version}
     username = db.Column(db.String(64), index=True, unique=True)
     first_name = db.Column(db.String(32))
     last_name = db.Column(db.String(32))
     password_hash = db.Column(db.String(128))
     access_level = db.Column(db.Integer)
 
-    discipline_id = db.Column(db.Integer, db.ForeignKey('discipline.id'))
+    discipline_id = db.Column(db.Integer, db.ForeignKey('discipline.id'), index=True)
 
     discipline_records = db.relationship('DisciplinePointRecord', backref='mentor', lazy='dynamic')
     refer_records = db.relationship('ReferPointRecord', backref='mentor', lazy='dynamic')
@@ -44,17 +55,20 @@ class Mentor(UserMixin, db.Model):
         return '<User> %s' % self.username
 
     def to_html(self):
-        render = get_template_attribute('admins/_mentor.html', 'render')
-        return render(self)
+        return render_fragment('admins/_mentor.html', 'render',
+                               (self.__tablename__, self.id, self.version, self.discipline_id), self)
 
     def is_admin(self):
         return self.access_level in [Access.ADMIN, Access.SUPER_ADMIN]
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(password, self.password_hash)
+
+    def password_needs_rehash(self):
+        return needs_rehash(self.password_hash)
 
     def is_in_group(self, group):
         return self.groups.filter_by(id=group.id).count() > 0
@@ -68,17 +82,74 @@ class Mentor(UserMixin, db.Model):
             self.groups.remove(group)
 
 
+# Данные вошедшего ментора для current_user, что бы не загружать Mentor на каждый запрос.
+# Для изменения ментора загружайте его через get_mentor()
+class MentorIdentity(UserMixin):
+    def __init__(self, mentor):
+        self.id = mentor.id
+        self.username = mentor.username
+        self.first_name = mentor.first_name
+        self.last_name = mentor.last_name
+        self.access_level = mentor.access_level
+        self.discipline_id = mentor.discipline_id
+
+    @property
+    def access(self):
+        return access_desc[self.access_level]
+
+    @property
+    def groups(self):
+        return Group.query.join(
+            group_mentors, group_mentors.c.group_id == Group.id
+        ).filter(group_mentors.c.mentor_id == self.id)
+
+    @property
+    def discipline(self):
+        if self.discipline_id is None:
+            return None
+        return Discipline.query.get(self.discipline_id)
+
+    def is_admin(self):
+        return self.access_level in [Access.ADMIN, Access.SUPER_ADMIN]
+
+    def get_mentor(self):
+        return Mentor.query.get(self.id)
+
+
+identities = LRUCache(app.config['MENTOR_CACHE_SIZE'], app.config['MENTOR_CACHE_TTL'])
+
+
 @login.user_loader
 def mentor_user(id):
-    return Mentor.query.get(int(id))
+    identity = identities.get(int(id))
+    if identity is None:
+        mentor = Mentor.query.get(int(id))
+        if mentor is None:
+            return None
+        identity = MentorIdentity(mentor)
+        identities.set(mentor.id, identity)
+    return identity
+
+
+def forget_mentor(mentor_id):
+    # Другие процессы увидят изменения не позже чем через MENTOR_CACHE_TTL секунд
+    identities.pop(mentor_id)
+
+
+# Баллы студента, см. Student.balances
+Balance = namedtuple('Balance', ['discipline', 'refer', 'spent', 'total'])
 
 
 class Student(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {'version_id_col': version}
     first_name = db.Column(db.String(32))
     last_name = db.Column(db.String(32))
     vk_id = db.Column(db.Integer, unique=True)
 
+    __table_args__ = (db.Index('ix_student_name', 'last_name', 'first_name'),)
+
     order_records = db.relationship('OrderRecord', backref='student', lazy='dynamic')
     discipline_records = db.relationship('DisciplinePointRecord', backref='student', lazy='dynamic')
     refer_records = db.relationship('ReferPointRecord', backref='student', lazy='dynamic')
@@ -86,31 +157,55 @@ class Student(db.Model):
                              secondary=group_students,
                              backref=db.backref('students', lazy='dynamic'),
                              lazy='dynamic')
+    balance = db.relationship('StudentBalance', backref='student', uselist=False,
+                              cascade='all, delete-orphan')
 
     @property
     def username(self):
         return self.last_name + ' ' + self.first_name
 
-    def to_html(self):
-        render = get_template_attribute('main/_student.html', 'render')
-        return render(self)
+    def to_html(self, balance=None):
+        if balance is None:
+            balance = Student.balances([self.id])[self.id]
+        return render_fragment('main/_student.html', 'render',
+                               (self.__tablename__, self.id, self.version, balance), self, balance)
+
+    @staticmethod
+    def balances(student_ids):
+        # {student_id: Balance} для списка студентов без загрузки записей
+        student_ids = set(student_ids)
+        if not student_ids:
+            return {}
+
+        rows = db.session.query(
+            StudentBalance.student_id, StudentBalance.discipline_points,
+            StudentBalance.refer_points, StudentBalance.spent_points
+        ).filter(StudentBalance.student_id.in_(student_ids)).all()
+        missing = student_ids - {row[0] for row in rows}
+        if missing:
+            totals = ledger_totals(missing)
+            rows += [(student_id,) + totals.get(student_id, (0, 0, 0)) for student_id in missing]
+
+        return {student_id: Balance(discipline, refer, spent, discipline + refer - spent)
+                for student_id, discipline, refer, spent in rows}
+
+    def get_balance(self):
+        # Строки баланса может не быть у студента без записей
+        if self.balance is None:
+            return StudentBalance.calculate(self.id)
+        return self.balance
 
     def orders_cost(self):
-        if self.order_records:
-            return sum(map(lambda x: x.cost, self.order_records))
+        return self.get_balance().spent_points
 
     def refer_points(self):
-        if self.refer_records:
-            return sum(map(lambda x: x.amount, self.refer_records))
-        return 0
+        return self.get_balance().refer_points
 
     def discipline_points(self):
-        if self.discipline_records:
-            return sum(map(lambda x: x.amount, self.discipline_records))
-        return 0
+        return self.get_balance().discipline_points
 
     def total_points(self):
-        return self.refer_points() + self.discipline_points() - self.orders_cost()
+        return self.get_balance().total
 
     def is_in_group(self, group):
         return self.groups.filter_by(id=group.id).count() > 0
@@ -126,17 +221,31 @@ class Student(db.Model):
 
 class Group(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {'version_id_col': version}
     name = db.Column(db.String(32), unique=True)
 
-    discipline_id = db.Column(db.Integer, db.ForeignKey('discipline.id'))
+    discipline_id = db.Column(db.Integer, db.ForeignKey('discipline.id'), index=True)
+
+    @property
+    def discipline_name(self):
+        return self.discipline.name if self.discipline else ''
+
+    def sorted_students(self):
+        return self.students.order_by(Student.last_name, Student.first_name).all()
 
     def to_html(self):
-        render = get_template_attribute('main/_group.html', 'render')
-        return render(self)
+        students = self.sorted_students()
+        balances = Student.balances(student.id for student in students)
+        key = (self.__tablename__, self.id, self.version, self.discipline_id,
+               tuple((student.id, student.version, balances[student.id]) for student in students))
+        return render_fragment('main/_group.html', 'render', key, self, students, balances)
 
 
 class Discipline(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {'version_id_col': version}
     name = db.Column(db.String(32))
 
     groups = db.relationship('Group', backref='discipline', lazy='dynamic')
@@ -144,21 +253,23 @@ class Discipline(db.Model):
     themes = db.relationship('Theme', backref='discipline', lazy='dynamic')
 
     def to_html(self):
-        render = get_template_attribute('disciplines/_discipline.html', 'render')
-        return render(self)
+        return render_fragment('disciplines/_discipline.html', 'render',
+                               (self.__tablename__, self.id, self.version), self)
 
 
 class Theme(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64))
     max_points = db.Column(db.Integer())
-    discipline_id = db.Column(db.Integer, db.ForeignKey('discipline.id'))
+    discipline_id = db.Column(db.Integer, db.ForeignKey('discipline.id'), index=True)
 
     records = db.relationship('DisciplinePointRecord', backref='theme', lazy='dynamic')
 
 
 class DisciplinePointRecord(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {'version_id_col': version}
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     amount = db.Column(db.Integer)
 
@@ -171,21 +282,22 @@ class DisciplinePointRecord(db.Model):
 
     @staticmethod
     def to_header():
-        render = get_template_attribute('main/_discipline_records.html', 'header')
-        return render()
+        return render_fragment('main/_discipline_records.html', 'header', ())
 
     def to_row(self):
-        render = get_template_attribute('main/_discipline_records.html', 'render')
-        return render(self)
+        return render_fragment('main/_discipline_records.html', 'render',
+                               (self.id, self.version, self.theme_id, self.mentor_id), self)
 
 
 class ReferPointRecord(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {'version_id_col': version}
     refer_vk_id = db.Column(db.Integer, unique=True)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     amount = db.Column(db.Integer)
 
-    student_id = db.Column(db.Integer, db.ForeignKey('student.id'))
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), index=True)
     mentor_id = db.Column(db.Integer, db.ForeignKey('mentor.id'))
 
     def delete_route(self):
@@ -193,40 +305,262 @@ class ReferPointRecord(db.Model):
 
     @staticmethod
     def to_header():
-        render = get_template_attribute('main/_referal_records.html', 'header')
-        return render()
+        return render_fragment('main/_referal_records.html', 'header', ())
 
     def to_row(self):
-        render = get_template_attribute('main/_referal_records.html', 'render')
-        return render(self)
+        return render_fragment('main/_referal_records.html', 'render',
+                               (self.id, self.version, self.mentor_id), self)
+
+
+# Баланс студента, обновляется вместе с записями о баллах и заказах
+class StudentBalance(db.Model):
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), primary_key=True)
+    discipline_points = db.Column(db.Integer, nullable=False, default=0)
+    refer_points = db.Column(db.Integer, nullable=False, default=0)
+    spent_points = db.Column(db.Integer, nullable=False, default=0)
+    # discipline + refer - spent, хранится для рейтинга, см. app/leaderboard.py
+    total = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+    @classmethod
+    def calculate(cls, student_id, totals=None):
+        if totals is None:
+            totals = ledger_totals([student_id])
+        discipline, refer, spent = totals.get(student_id, (0, 0, 0))
+        return cls(student_id=student_id, discipline_points=discipline,
+                   refer_points=refer, spent_points=spent, total=discipline + refer - spent)
+
+    @classmethod
+    def change(cls, student_id, discipline=0, refer=0, spent=0):
+        # Вызывается после add/delete записи, до commit
+        updated = cls.query.filter_by(student_id=student_id).update({
+            cls.discipline_points: cls.discipline_points + discipline,
+            cls.refer_points: cls.refer_points + refer,
+            cls.spent_points: cls.spent_points + spent,
+            cls.total: cls.total + discipline + refer - spent
+        })
+        if not updated:
+            # Строки еще нет - считаем по записям, autoflush уже учел текущее изменение
+            db.session.add(cls.calculate(student_id))
+
+    @classmethod
+    def change_many(cls, discipline):
+        # {student_id: баллы} - начисление многим студентам, один UPDATE на каждую сумму
+        by_amount = {}
+        for student_id, amount in discipline.items():
+            by_amount.setdefault(amount, []).append(student_id)
+
+        size = app.config['BULK_CHUNK_SIZE']
+        for amount, student_ids in by_amount.items():
+            for i in range(0, len(student_ids), size):
+                cls.query.filter(cls.student_id.in_(student_ids[i:i + size])).update({
+                    cls.discipline_points: cls.discipline_points + amount,
+                    cls.total: cls.total + amount
+                }, synchronize_session=False)
+
+        cls.add_missing(discipline)
+
+    @classmethod
+    def recalculate(cls, student_ids):
+        # Пересчитать балансы по записям: один UPDATE с подзапросами на пачку студентов,
+        # для массовой загрузки записей, где считать приращения дороже
+        def points(column, student_id):
+            return db.func.coalesce(db.select([db.func.sum(column)]).where(
+                student_id == cls.student_id).as_scalar(), 0)
+
+        discipline = points(DisciplinePointRecord.amount, DisciplinePointRecord.student_id)
+        refer = points(ReferPointRecord.amount, ReferPointRecord.student_id)
+        spent = points(OrderRecord.cost, OrderRecord.student_id)
+
+        student_ids = list(student_ids)
+        size = app.config['BULK_CHUNK_SIZE']
+        for i in range(0, len(student_ids), size):
+            cls.query.filter(cls.student_id.in_(student_ids[i:i + size])).update({
+                cls.discipline_points: discipline,
+                cls.refer_points: refer,
+                cls.spent_points: spent,
+                cls.total: discipline + refer - spent
+            }, synchronize_session=False)
+        cls.add_missing(student_ids)
+
+    @classmethod
+    def add_missing(cls, student_ids):
+        # Строки баланса тем, у кого их еще нет, суммы по записям одним запросом на пачку
+        student_ids = list(student_ids)
+        size = app.config['BULK_CHUNK_SIZE']
+        for i in range(0, len(student_ids), size):
+            chunk = student_ids[i:i + size]
+            existing = {student_id for student_id, in db.session.query(cls.student_id).filter(
+                cls.student_id.in_(chunk))}
+            missing = [student_id for student_id in chunk if student_id not in existing]
+            if missing:
+                totals = ledger_totals(missing)
+                db.session.add_all(cls.calculate(student_id, totals) for student_id in missing)
+
+    @classmethod
+    def spend(cls, student_id, amount):
+        # Списать, только если хватает баллов. Проверка и списание - один UPDATE:
+        # Postgres блокирует строку до commit, SQLite - запись во всю базу,
+        # поэтому параллельный заказ увидит уже уменьшенный баланс
+        if not db.session.query(cls.query.filter_by(student_id=student_id).exists()).scalar():
+            # Первый заказ могут сделать двое сразу - строку вставит кто-то один
+            balance = cls.calculate(student_id)
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(cls.__table__.insert().values(
+                        student_id=student_id, discipline_points=balance.discipline_points,
+                        refer_points=balance.refer_points, spent_points=balance.spent_points,
+                        total=balance.total))
+            except IntegrityError:
+                pass
+        return cls.query.filter(cls.student_id == student_id, cls.total >= amount).update({
+            cls.spent_points: cls.spent_points + amount,
+            cls.total: cls.total - amount
+        }) == 1
 
 
 class VkGroup(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {'version_id_col': version}
     name = db.Column(db.String(128))
     token = db.Column(db.String(128))
     confirmation_key = db.Column(db.String(32))
     secret_key = db.Column(db.String(64))
     message = db.Column(db.String(256), default=default_message)
 
+    outbound_messages = db.relationship('OutboundMessage', backref='vk_group', lazy='dynamic',
+                                        cascade='all, delete-orphan')
+
     def answer(self, student):
         message = self.message
         return message.format(username=student.username, points=student.total_points())
 
     def to_html(self):
-        render = get_template_attribute('communities/_community.html', 'render')
-        return render(self)
+        return render_fragment('communities/_community.html', 'render',
+                               (self.__tablename__, self.id, self.version), self)
+
+
+# Очередь ответов бота, отправляется воркером (flask bot worker)
+class OutboundMessage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    peer_id = db.Column(db.Integer)
+    message = db.Column(db.String(4096))
+    random_id = db.Column(db.Integer)
+    status_id = db.Column(db.Integer, default=OutboundStatus.Pending)
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.String(256))
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    vk_group_id = db.Column(db.Integer, db.ForeignKey('vk_group.id'), index=True)
+
+    __table_args__ = (db.Index('ix_outbound_message_status_next', 'status_id', 'next_attempt'),)
+
+    @classmethod
+    def enqueue(cls, group, peer_id, message):
+        # random_id сохраняется, что бы VK отбросил повторную отправку при ретрае
+        outbound = cls(vk_group_id=group.id, peer_id=peer_id, message=message,
+                       random_id=get_random_id())
+        db.session.add(outbound)
+        return outbound
+
+    @classmethod
+    def ready(cls, now):
+        # Ожидающие и зависшие в отправке дольше аренды
+        return cls.query.filter(
+            cls.status_id.in_([OutboundStatus.Pending, OutboundStatus.Sending]),
+            cls.next_attempt <= now
+        ).order_by(cls.id)
+
+    @classmethod
+    def claim(cls, message_id, now, lease_until):
+        # Атомарно, только один воркер получит сообщение
+        return cls.query.filter(
+            cls.id == message_id,
+            cls.status_id.in_([OutboundStatus.Pending, OutboundStatus.Sending]),
+            cls.next_attempt <= now
+        ).update({cls.status_id: OutboundStatus.Sending, cls.next_attempt: lease_until},
+                 synchronize_session=False) > 0
+
+    def sent(self):
+        self.status_id = OutboundStatus.Sent
+        self.attempts += 1
+        self.last_error = None
+
+    def fail(self, error, max_attempts, permanent=False):
+        self.attempts += 1
+        self.last_error = str(error)[:256]
+        if permanent or self.attempts >= max_attempts:
+            self.status_id = OutboundStatus.Failed
+        else:
+            self.status_id = OutboundStatus.Pending
+            self.next_attempt = datetime.utcnow() + timedelta(seconds=min(2 ** self.attempts, 300))
+
+
+# Обработанные события Callback API, общие для всех воркеров
+class ProcessedEvent(db.Model):
+    vk_group_id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.String(64), primary_key=True)
+    timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+
+
+# Прогресс загрузки старых записей (app/history.py), меняется в одной транзакции с пачкой
+class ImportProgress(db.Model):
+    name = db.Column(db.String(512), primary_key=True)
+    kind = db.Column(db.String(16))
+    rows = db.Column(db.Integer, nullable=False, default=0)
+    imported = db.Column(db.Integer, nullable=False, default=0)
+    skipped = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Integer, nullable=False, default=0)
+    done = db.Column(db.Boolean, nullable=False, default=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# Итог массового добавления студентов, вместо flash на каждого
+class ImportReport(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    details = db.Column(db.Text)
+
+    mentor_id = db.Column(db.Integer, db.ForeignKey('mentor.id'))
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id', ondelete='SET NULL'))
+
+    mentor = db.relationship('Mentor')
+    group = db.relationship('Group')
+
+    # Списки vk_id по категориям
+    sections = [('created', 'Добавлены в базу'),
+                ('existing', 'Уже были в базе'),
+                ('added', 'Добавлены в группу'),
+                ('in_group', 'Уже состояли в группе'),
+                ('not_found', 'Не найдены Вконтакте')]
+
+    def get_details(self):
+        return json.loads(self.details or '{}')
+
+    def set_details(self, details):
+        self.details = json.dumps(details)
 
 
 class OrderRecord(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {'version_id_col': version}
     cost = db.Column(db.Integer)
     status_id = db.Column(db.Integer)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     commentary = db.Column(db.String(256))
 
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'), index=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), index=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'))
+
+    __table_args__ = (db.Index('ix_order_record_order_status', 'order_id', 'status_id', 'timestamp'),)
+
+    @classmethod
+    def page_keys(cls):
+        # Ключи постраничного вывода по времени. У старых заказов времени нет,
+        # а NULL нельзя ни сравнить в курсоре, ни пропустить - считаем их самыми ранними
+        return [(db.func.coalesce(cls.timestamp, datetime(1970, 1, 1)), False), (cls.id, False)]
 
     @property
     def status(self):
@@ -235,18 +569,33 @@ class OrderRecord(db.Model):
     def delete_route(self):
         return url_for('main.delete_order_record', record_id=self.id)
 
+    @staticmethod
+    def advance(record_ids, status_id):
+        # Перевод пачки заказов в статус одним UPDATE на пачку, только вперед:
+        # заказанный -> отправлен -> получен. version увеличиваем сами, ORM тут не участвует
+        record_ids = list(record_ids)
+        size = app.config['BULK_CHUNK_SIZE']
+        updated = 0
+        for i in range(0, len(record_ids), size):
+            updated += OrderRecord.query.filter(
+                OrderRecord.id.in_(record_ids[i:i + size]), OrderRecord.status_id < status_id
+            ).update({OrderRecord.status_id: status_id,
+                      OrderRecord.version: OrderRecord.version + 1}, synchronize_session=False)
+        return updated
+
     @staticmethod
     def to_header():
-        render = get_template_attribute('main/_order_records.html', 'header')
-        return render()
+        return render_fragment('main/_order_records.html', 'header', ())
 
     def to_row(self):
-        render = get_template_attribute('main/_order_records.html', 'render')
-        return render(self)
+        return render_fragment('main/_order_records.html', 'render',
+                               (self.id, self.version, self.student_id, self.order_id), self)
 
 
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {'version_id_col': version}
     name = db.Column(db.String(32), unique=True)
     cost = db.Column(db.Integer)
     description = db.Column(db.String(256))
@@ -259,5 +608,31 @@ class Order(db.Model):
         return ['Подарок', 'Скидка'][self.type_id - 1]
 
     def to_html(self):
-        render = get_template_attribute('main/_order.html', 'render')
-        return render(self)
+        return render_fragment('main/_order.html', 'render',
+                               (self.__tablename__, self.id, self.version), self)
+
+
+def ledger_totals(student_ids=None):
+    # Суммы по исходным записям одним запросом: {student_id: (discipline, refer, spent)}
+    zero = db.literal_column('0')
+    parts = []
+    for student_id, discipline, refer, spent in (
+            (DisciplinePointRecord.student_id, DisciplinePointRecord.amount, zero, zero),
+            (ReferPointRecord.student_id, zero, ReferPointRecord.amount, zero),
+            (OrderRecord.student_id, zero, zero, OrderRecord.cost)):
+        part = db.select([student_id.label('student_id'), discipline.label('discipline'),
+                          refer.label('refer'), spent.label('spent')])
+        if student_ids is not None:
+            part = part.where(student_id.in_(student_ids))
+        parts.append(part)
+    ledger = db.union_all(*parts).alias('ledger')
+
+    rows = db.session.query(
+        ledger.c.student_id,
+        db.func.coalesce(db.func.sum(ledger.c.discipline), 0),
+        db.func.coalesce(db.func.sum(ledger.c.refer), 0),
+        db.func.coalesce(db.func.sum(ledger.c.spent), 0)
+    ).group_by(ledger.c.student_id)
+
+    return {student_id: (int(discipline), int(refer), int(spent))
+            for student_id, discipline, refer, spent in rows}
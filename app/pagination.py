@@ -0,0 +1,127 @@
+import json
+import base64
+from datetime import datetime
+from flask import request
+from app import app, db
+from app.cache import LRUCache
+
+# Постраничный вывод по курсору: WHERE (ключи) > (последние значения) вместо OFFSET.
+# Ключи - список (выражение, по убыванию), последний ключ должен быть уникальным (id)
+
+counts = LRUCache(app.config['PAGINATION_COUNT_CACHE_SIZE'],
+                  ttl=app.config['PAGINATION_COUNT_TTL'])
+
+
+class KeysetPage:
+    keyset = True
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return {'$dt': value.isoformat()}
+    raise TypeError(value)
+
+
+def _object_hook(value):
+    if '$dt' in value:
+        return datetime.fromisoformat(value['$dt'])
+    return value
+
+
+def encode_cursor(direction, values):
+    data = json.dumps([direction, values], default=_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, values = json.loads(data.decode(), object_hook=_object_hook)
+    except (ValueError, TypeError):
+        return 'next', None
+    # Курсор приходит от клиента: только список простых значений, иначе первая страница
+    if direction not in ('next', 'prev') or not isinstance(values, list) or \
+            not all(isinstance(value, (str, int, float, datetime)) for value in values):
+        return 'next', None
+    return direction, values
+
+
+def _after(keys, values, backwards):
+    # (a > x) OR (a = x AND b > y) OR ... с учетом направления каждого ключа
+    conditions = []
+    for i, (expression, descending) in enumerate(keys):
+        greater = descending == backwards
+        compare = expression > values[i] if greater else expression < values[i]
+        conditions.append(db.and_(*[keys[j][0] == values[j] for j in range(i)] + [compare]))
+    return db.or_(*conditions)
+
+
+def cached_count(query):
+    # Точное число не нужно на каждой странице - кэшируем на PAGINATION_COUNT_TTL секунд
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    key = (str(compiled), repr(sorted(compiled.params.items())))
+    total = counts.get(key)
+    if total is None:
+        total = query.order_by(None).count()
+        counts.set(key, total)
+    return total
+
+
+def keyset_paginate(query, keys, per_page, cursor=None, count=True):
+    direction, values = decode_cursor(cursor) if cursor else ('next', None)
+    if values is not None and len(values) != len(keys):
+        direction, values = 'next', None
+    backwards = direction == 'prev'
+
+    total = cached_count(query) if count else None
+
+    ordered = query.order_by(None).order_by(*[
+        expression.desc() if descending != backwards else expression.asc()
+        for expression, descending in keys
+    ])
+    if values is not None:
+        ordered = ordered.filter(_after(keys, values, backwards))
+
+    rows = ordered.add_columns(*[
+        expression.label('_key%i' % i) for i, (expression, _) in enumerate(keys)
+    ]).limit(per_page + 1).all()
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    # Есть ли что-то дальше по направлению запроса - видно по лишней строке,
+    # в обратную сторону - по наличию курсора
+    has_next = values is not None if backwards else more
+    has_prev = more if backwards else values is not None
+
+    # Запрос одной сущности - элементы страницы это объекты, иначе строки без ключей
+    width = len(query.column_descriptions)
+    items = [row[0] if width == 1 else row[:width] for row in rows]
+    page = KeysetPage(items, per_page, total=total)
+    # Курсор - значения добавленных столбцов _key, они идут после столбцов запроса
+    if rows and has_next:
+        page.next_cursor = encode_cursor('next', list(rows[-1][width:]))
+    if rows and has_prev:
+        page.prev_cursor = encode_cursor('prev', list(rows[0][width:]))
+    return page
+
+
+def paginate(query, keys, per_page, count=True):
+    return keyset_paginate(query, keys, per_page, request.args.get('cursor'), count)
@@ -0,0 +1,87 @@
+import bcrypt
+from werkzeug.security import generate_password_hash, check_password_hash
+from app import app
+
+# Хэширование паролей менторов. Схема и стоимость задаются в конфиге
+# (PASSWORD_HASHER, PBKDF2_ITERATIONS, BCRYPT_ROUNDS), хэши со старыми
+# параметрами пересчитываются при входе. Замерить: flask password benchmark
+
+
+class PBKDF2Hasher:
+    name = 'pbkdf2'
+
+    def __init__(self, cost=None):
+        self.cost = cost or app.config['PBKDF2_ITERATIONS']
+
+    def identify(self, password_hash):
+        return password_hash.startswith('pbkdf2:')
+
+    def hash(self, password):
+        return generate_password_hash(password, method='pbkdf2:sha256:%i' % self.cost)
+
+    def verify(self, password, password_hash):
+        return check_password_hash(password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        # pbkdf2:sha256:150000$соль$хэш
+        method = password_hash.split('$', 1)[0].split(':')
+        return method[1:] != ['sha256', str(self.cost)]
+
+
+class BcryptHasher:
+    name = 'bcrypt'
+
+    def __init__(self, cost=None):
+        self.cost = cost or app.config['BCRYPT_ROUNDS']
+
+    @staticmethod
+    def encode(password):
+        # bcrypt учитывает только первые 72 байта, новые версии на длинных паролях падают
+        return password.encode('utf-8')[:72]
+
+    def identify(self, password_hash):
+        return password_hash.startswith('$2')
+
+    def hash(self, password):
+        return bcrypt.hashpw(self.encode(password), bcrypt.gensalt(self.cost)).decode('ascii')
+
+    def verify(self, password, password_hash):
+        try:
+            return bcrypt.checkpw(self.encode(password), password_hash.encode('ascii'))
+        except ValueError:
+            return False
+
+    def needs_rehash(self, password_hash):
+        # $2b$12$...
+        return password_hash[4:6] != '%02i' % self.cost
+
+
+hashers = {
+    'pbkdf2': PBKDF2Hasher,
+    'bcrypt': BcryptHasher
+}
+
+
+def get_hasher(name=None, cost=None):
+    return hashers[name or app.config['PASSWORD_HASHER']](cost)
+
+
+def identify(password_hash):
+    for hasher in hashers.values():
+        if hasher().identify(password_hash):
+            return hasher()
+    return None
+
+
+def hash_password(password):
+    return get_hasher().hash(password)
+
+
+def verify_password(password, password_hash):
+    hasher = identify(password_hash or '')
+    return hasher is not None and hasher.verify(password, password_hash)
+
+
+def needs_rehash(password_hash):
+    hasher = get_hasher()
+    return not hasher.identify(password_hash) or hasher.needs_rehash(password_hash)
@@ -0,0 +1,96 @@
+import re
+import time
+from collections import Counter, deque
+from datetime import datetime
+from flask import g, request, has_request_context
+from flask_login import current_user
+from sqlalchemy import event
+from app import app, db
+
+# Число запросов и время в базе для каждой страницы: заголовок X-SQL-Stats
+# (только у админов) и последние страницы в /mentor/debug/sql. Одинаковый запрос,
+# повторенный много раз за страницу, обычно значит ленивую загрузку связи в цикле (N+1).
+# Включается SQL_STATS=1.
+
+
+def normalize(statement):
+    # IN (?, ?, ?) и литералы не должны делать запросы разными
+    statement = re.sub(r'\s+', ' ', statement).strip()
+    statement = re.sub(r'\b\d+\b', '?', statement)
+    statement = re.sub(r"'[^']*'", '?', statement)
+    return re.sub(r'\((?:\s*(?:\?|%\(\w+\)s)\s*,?)+\)', '(?)', statement)
+
+
+class RequestStats:
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.statements = Counter()
+        self.slowest = []
+
+    def add(self, statement, duration):
+        self.count += 1
+        self.time += duration
+        self.statements[normalize(statement)] += 1
+        self.slowest.append((duration, statement))
+        self.slowest = sorted(self.slowest, reverse=True)[:app.config['SQL_STATS_SLOWEST']]
+
+    def repeated(self):
+        return [(statement, count) for statement, count in self.statements.most_common()
+                if count >= app.config['SQL_STATS_REPEAT_THRESHOLD']]
+
+    def header(self):
+        return 'queries=%i; time=%.1fms; repeated=%i' % (self.count, self.time * 1000,
+                                                          len(self.repeated()))
+
+
+# Последние страницы, для админов
+history = deque(maxlen=app.config['SQL_STATS_HISTORY'])
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info['query_start'].pop()
+    if has_request_context() and 'sql_stats' in g:
+        g.sql_stats.add(statement, time.perf_counter() - start)
+
+
+def handle_error(context):
+    starts = context.connection.info.get('query_start') if context.connection else None
+    if starts:
+        starts.pop()
+
+
+def start_request():
+    g.sql_stats = RequestStats()
+
+
+def finish_request(response):
+    stats = g.pop('sql_stats', None)
+    if stats is None:
+        return response
+
+    if current_user.is_authenticated and current_user.is_admin():
+        response.headers['X-SQL-Stats'] = stats.header()
+    repeated = stats.repeated()
+    if repeated:
+        app.logger.warning('%s: запрос повторен %i раз, возможно N+1: %s',
+                           request.endpoint, repeated[0][1], repeated[0][0][:200])
+
+    history.appendleft(dict(timestamp=datetime.utcnow(), endpoint=request.endpoint,
+                            path=request.full_path.rstrip('?'), status=response.status_code,
+                            count=stats.count, time=stats.time,
+                            slowest=stats.slowest, repeated=repeated))
+    return response
+
+
+if app.config['SQL_STATS']:
+    engine = db.get_engine(app)
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(engine, 'handle_error', handle_error)
+    app.before_request(start_request)
+    app.after_request(finish_request)
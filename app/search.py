@@ -0,0 +1,151 @@
+from app import db
+from app.models import Student
+
+# Поиск студентов по имени (префикс и триграммы) и vk_id.
+# Индекс строится в миграции, пересоздать: flask search rebuild
+
+
+def escape(text):
+    # Текст пользователя в LIKE - без подстановочных символов
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def starts(column, word):
+    return column.like(escape(word) + '%', escape='\\')
+
+
+def trigrams(text):
+    result = []
+    for word in text.lower().split():
+        result += [word[i:i + 3] for i in range(len(word) - 2)]
+    return list(dict.fromkeys(result))
+
+
+def prefix_rank(words):
+    # 0 - фамилия начинается с запроса, 1 - имя, 2 - остальные совпадения
+    def either(column, word):
+        return db.or_(starts(column, word.capitalize()), starts(column, word.lower()))
+
+    return db.case([
+        (either(Student.last_name, words[0]), 0),
+        (db.or_(*[either(Student.first_name, w) for w in words]), 1)
+    ], else_=2)
+
+
+class LikeSearch:
+    # Запасной вариант без индекса, для коротких запросов и других СУБД
+    def students(self, text):
+        words = text.split()
+        conditions = [db.or_(starts(Student.last_name, w.capitalize()),
+                             starts(Student.first_name, w.capitalize()),
+                             starts(Student.last_name, w.lower()),
+                             starts(Student.first_name, w.lower())) for w in words]
+        return Student.query.filter(db.and_(*conditions)).order_by(
+            prefix_rank(words), Student.last_name, Student.first_name, Student.id)
+
+    def install(self):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class SqliteSearch(LikeSearch):
+    # FTS5 с триграммным токенизатором, таблица синхронизируется триггерами
+    _installed = False
+    statements = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS student_search USING fts5("
+        "last_name, first_name, content='student', content_rowid='id', tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS student_search_ai AFTER INSERT ON student BEGIN "
+        "INSERT INTO student_search(rowid, last_name, first_name) "
+        "VALUES (new.id, new.last_name, new.first_name); END",
+        "CREATE TRIGGER IF NOT EXISTS student_search_ad AFTER DELETE ON student BEGIN "
+        "INSERT INTO student_search(student_search, rowid, last_name, first_name) "
+        "VALUES ('delete', old.id, old.last_name, old.first_name); END",
+        "CREATE TRIGGER IF NOT EXISTS student_search_au AFTER UPDATE ON student BEGIN "
+        "INSERT INTO student_search(student_search, rowid, last_name, first_name) "
+        "VALUES ('delete', old.id, old.last_name, old.first_name); "
+        "INSERT INTO student_search(rowid, last_name, first_name) "
+        "VALUES (new.id, new.last_name, new.first_name); END"
+    ]
+
+    def students(self, text):
+        grams = trigrams(text)
+        if not grams or not self.installed():
+            return super(SqliteSearch, self).students(text)
+
+        # Любая общая триграмма - кандидат, bm25 ставит выше тех, где совпало больше
+        match = ' OR '.join('"%s"' % gram.replace('"', '""') for gram in grams)
+        found = db.select([
+            db.literal_column('rowid').label('id'),
+            db.literal_column('bm25(student_search)').label('rank')
+        ]).select_from(db.table('student_search')).where(
+            db.literal_column('student_search').match(match)
+        ).alias('found')
+
+        return Student.query.join(found, found.c.id == Student.id).order_by(
+            prefix_rank(text.split()), found.c.rank, Student.last_name, Student.id)
+
+    @classmethod
+    def installed(cls):
+        # База могла быть создана через create_all, без миграции
+        if not cls._installed:
+            cls._installed = db.engine.dialect.has_table(db.engine, 'student_search')
+        return cls._installed
+
+    def install(self):
+        for statement in self.statements:
+            db.session.execute(statement)
+
+    def rebuild(self):
+        db.session.execute("INSERT INTO student_search(student_search) VALUES ('rebuild')")
+
+
+class PostgresSearch(LikeSearch):
+    # pg_trgm, GIN индекс по выражению name_expression
+    statements = [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_student_name_trgm ON student USING gin "
+        "((lower(coalesce(last_name, '') || ' ' || coalesce(first_name, ''))) gin_trgm_ops)"
+    ]
+
+    @staticmethod
+    def name_expression():
+        # Должно совпадать с выражением индекса
+        empty = db.literal_column("''")
+        return db.func.lower(db.func.coalesce(Student.last_name, empty).op('||')(
+            db.literal_column("' '")).op('||')(db.func.coalesce(Student.first_name, empty)))
+
+    def students(self, text):
+        text = text.lower()
+        if len(text.strip()) < 3:
+            return super(PostgresSearch, self).students(text)
+
+        name = self.name_expression()
+        return Student.query.filter(
+            db.or_(name.like('%' + escape(text) + '%', escape='\\'), name.op('%>')(text))
+        ).order_by(
+            prefix_rank(text.split()), db.func.word_similarity(text, name).desc(),
+            Student.last_name, Student.id
+        )
+
+    def install(self):
+        for statement in self.statements:
+            db.session.execute(statement)
+
+
+backends = {
+    'sqlite': SqliteSearch,
+    'postgresql': PostgresSearch
+}
+
+
+def get_backend(dialect=None):
+    return backends.get(dialect or db.engine.dialect.name, LikeSearch)()
+
+
+def search_students(text):
+    text = text.strip()
+    if text.isdigit():
+        return Student.query.filter_by(vk_id=int(text))
+    return get_backend().students(text)
@@ -1,6 +1,7 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, IntegerField, SubmitField, SelectField
+from wtforms import StringField, IntegerField, SubmitField
 from wtforms.validators import ValidationError, DataRequired
+from app.choices import TypeaheadField
 from app.models import Student, Group
 
 
@@ -36,18 +37,17 @@ class ChangeStudentForm(StudentForm):
 
 
 class GroupStudentForm(FlaskForm):
-    groups = SelectField('Группа', validators=[DataRequired()], coerce=int)
+    groups = TypeaheadField('Группа', validators=[DataRequired()], endpoint='main.typeahead_groups')
     submit = SubmitField('Добавить')
 
     def __init__(self, user, *args, **kwargs):
         super(GroupStudentForm, self).__init__(*args, **kwargs)
-        group_ids = user.groups.with_entities(Group.id)
-        self.groups.choices = [(t.id, t.name) for t in
-                               Group.query.filter(
-                                   Group.id.notin_(group_ids)
-                               ).all()]
+        self._user = user
+        self.groups.params = dict(student_id=user.id)
 
     def validate_groups(self, groups):
         group = Group.query.filter_by(id=groups.data).first()
         if group is None:
             raise ValidationError('Нет такой группы')
+        if self._user.is_in_group(group):
+            raise ValidationError('Студент уже в этой группе')
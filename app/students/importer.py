@@ -0,0 +1,74 @@
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from app.models import Student, StudentBalance, ImportReport, group_students
+from app.utils import chunks
+
+
+def import_students(requested_ids, users, mentor, group=None):
+    # Массовое добавление: поиск одним IN на пачку, вставка пачкой, без запросов на студента
+    size = app.config['BULK_CHUNK_SIZE']
+    users = {user['id']: user for user in users}
+    vk_ids = list(users)
+
+    existing = set()
+    for chunk in chunks(vk_ids, size):
+        existing.update(vk_id for vk_id, in db.session.query(Student.vk_id).filter(
+            Student.vk_id.in_(chunk)))
+
+    created = [vk_id for vk_id in vk_ids if vk_id not in existing]
+    while created:
+        # Тех же студентов может одновременно добавлять кто-то еще - их пропускаем
+        try:
+            with db.session.begin_nested():
+                db.session.execute(Student.__table__.insert(), [
+                    dict(first_name=users[vk_id]['first_name'], last_name=users[vk_id]['last_name'],
+                         vk_id=vk_id) for vk_id in created
+                ])
+            break
+        except IntegrityError:
+            for chunk in chunks(created, size):
+                existing.update(vk_id for vk_id, in db.session.query(Student.vk_id).filter(
+                    Student.vk_id.in_(chunk)))
+            created = [vk_id for vk_id in created if vk_id not in existing]
+    if created:
+        columns = ['discipline_points', 'refer_points', 'spent_points', 'total']
+        zeros = [db.literal_column('0').label(column) for column in columns]
+        for chunk in chunks(created, size):
+            db.session.execute(StudentBalance.__table__.insert().from_select(
+                ['student_id'] + columns,
+                db.select([Student.id] + zeros).where(Student.vk_id.in_(chunk))
+            ))
+
+    details = dict(created=created,
+                   existing=[vk_id for vk_id in vk_ids if vk_id in existing],
+                   not_found=[vk_id for vk_id in requested_ids if vk_id not in users])
+
+    if group is not None:
+        in_group = set()
+        for chunk in chunks(vk_ids, size):
+            in_group.update(vk_id for vk_id, in db.session.query(Student.vk_id).join(
+                group_students, group_students.c.student_id == Student.id
+            ).filter(group_students.c.group_id == group.id, Student.vk_id.in_(chunk)))
+
+            # Антиджойн: только тех, кого еще нет в группе. Если их добавили в группу
+            # параллельно, повторяем - антиджойн их уже пропустит
+            membership = db.exists().where(db.and_(group_students.c.student_id == Student.id,
+                                                   group_students.c.group_id == group.id))
+            while True:
+                try:
+                    with db.session.begin_nested():
+                        db.session.execute(group_students.insert().from_select(
+                            ['student_id', 'group_id'],
+                            db.select([Student.id, db.literal(group.id, db.Integer)]).where(
+                                db.and_(Student.vk_id.in_(chunk), ~membership))
+                        ))
+                    break
+                except IntegrityError:
+                    pass
+        details['added'] = [vk_id for vk_id in vk_ids if vk_id not in in_group]
+        details['in_group'] = [vk_id for vk_id in vk_ids if vk_id in in_group]
+
+    report = ImportReport(mentor_id=mentor.id, group_id=group.id if group else None)
+    report.set_details(details)
+    db.session.add(report)
+    return report
@@ -1,13 +1,17 @@
 from flask import render_template, flash, redirect, url_for, g, request
 from flask_login import current_user, login_required
-import vk_api
 from wtforms.validators import ValidationError
 from app import app, db
 from app.students import bp
 from app.students.forms import StudentForm, ChangeStudentForm, GroupStudentForm
 from app.constants import Access
-from app.utils import admin_required, get_student, is_admin, get_vk_users_data
-from app.models import Student, Group
+from app.students.importer import import_students
+from app.search import search_students
+from app.pagination import paginate
+from app.leaderboard import place, group_places
+from app.access import scope
+from app.utils import admin_required, get_student, is_admin, get_vk_users_data, parse_vk_ids
+from app.models import Student, StudentBalance, Group, ImportReport
 
 
 @bp.route('/list', methods=['GET', 'POST'])
@@ -26,16 +30,19 @@ def list():
             new_student = Student(first_name=form.first_name.data,
                                   last_name=form.last_name.data,
                                   vk_id=form.vk_id.data)
+            new_student.balance = StudentBalance()
 
             db.session.add(new_student)
             db.session.commit()
             flash('Студент %s добавлен' % (
                     new_student.last_name + ' ' + new_student.first_name))
-            return redirect(url_for('students.list', page=page))
+            return redirect(url_for('students.list'))
 
-    students = Student.query.order_by(
-        Student.last_name, Student.first_name
-    )
+    q = request.args.get('q', '').strip()
+    if q:
+        students = scope().students(search_students(q))
+    else:
+        students = scope().students()
 
     if r_form.get('search', None):
         if r_form.get('first_name', None):
@@ -45,13 +52,21 @@ def list():
         if r_form.get('_id', None):
             students = students.filter_by(vk_id=r_form['_id'].replace(' ', ''))
 
-    students = students.paginate(
-        page, app.config['STUDENTS_PER_PAGE'], False
-    )
+    # Результаты поиска упорядочены по релевантности, их немного - обычные страницы
+    if q:
+        students = students.paginate(
+            page, app.config['STUDENTS_PER_PAGE'], False
+        )
+    else:
+        students = paginate(students, [(Student.last_name, False), (Student.first_name, False),
+                                       (Student.id, False)],
+                            app.config['STUDENTS_PER_PAGE'])
+
+    balances = Student.balances(student.id for student in students.items)
 
     g.url_for = 'students.list'
-    return render_template('students/student_list.html', form=form,
-                           title='Список студентов', data=students)
+    return render_template('students/student_list.html', form=form, q=q,
+                           title='Список студентов', data=students, balances=balances)
 
 
 @bp.route('/id/<student_id>', methods=['GET', 'POST'])
@@ -62,6 +77,14 @@ def student(student_id):
     group_form = None
     request_form = request.form
 
+    # Места в рейтингах: (название, ссылка, место, всего)
+    groups = user.groups.all()
+    positions = group_places(user, groups)
+    places = [(group.name, url_for('main.leaderboard', group_id=group.id, student=user.id)) +
+              positions[group.id] for group in groups]
+    if current_user.access_level not in [Access.MENTOR, Access.UP_MENTOR]:
+        places.insert(0, ('Школа', url_for('main.leaderboard', student=user.id)) + place(user))
+
     if is_admin(current_user):
 
         form = ChangeStudentForm(user)
@@ -69,7 +92,7 @@ def student(student_id):
 
         if not request_form.get('submit', None):
             return render_template('students/student_page.html', group_form=group_form,
-                                   form=form, student=user, title=user.username)
+                                   form=form, student=user, title=user.username, places=places)
 
         if request_form['submit'] == 'Изменить' and form.validate_on_submit():
             user.first_name = form.first_name.data
@@ -91,31 +114,33 @@ def student(student_id):
             return redirect(url_for('students.student', student_id=user.id))
 
     return render_template('students/student_page.html', group_form=group_form,
-                           form=form, student=user, title=user.username)
+                           form=form, student=user, title=user.username, places=places)
 
 
 @bp.route('/multiple_add', methods=['POST'])
+@login_required
 def multiple_add():
-    r_form = request.form
-
-    users = get_vk_users_data(r_form)
-    if users is None:
+    ids = parse_vk_ids(request.form)
+    if ids is None:
         flash('Проверьте правильность id')
         return redirect(url_for('students.list'))
 
-    for user in users:
-        student = Student.query.filter_by(vk_id=user['id']).first()
-        if student is not None:
-            flash("Студет с id %s уже зарегистрирован в системе" % user['id'])
-        else:
-            student = Student(first_name=user['first_name'],
-                              last_name=user['last_name'],
-                              vk_id=user['id'])
-            db.session.add(student)
-            flash("Студент %s vk_id: %i Добавлен" % (student.username, student.vk_id))
+    report = import_students(ids, get_vk_users_data(ids), current_user)
     db.session.commit()
 
-    return redirect(url_for('students.list'))
+    return redirect(url_for('students.import_report', report_id=report.id))
+
+
+@bp.route('/import/<report_id>')
+@login_required
+def import_report(report_id):
+    reports = ImportReport.query.filter_by(id=report_id)
+    if not is_admin(current_user):
+        reports = reports.filter_by(mentor_id=current_user.id)
+    report = reports.first_or_404()
+
+    return render_template('students/import_report.html', report=report,
+                           details=report.get_details(), title='Итоги добавления')
 
 
 @bp.route('/remove/<student_id>')
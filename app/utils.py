@@ -1,9 +1,10 @@
 from functools import wraps
-from flask import redirect, url_for, abort, flash
+from flask import redirect, url_for, flash
 from flask_login import current_user
-import vk_api
 from app import app
-from app.models import Mentor, Student, Group, DisciplinePointRecord, Theme
+from app.vk import service_session
+from app.models import Mentor, Student, Group
+from app.access import scope
 from app.constants import Access
 
 
@@ -29,22 +30,20 @@ def angel_required(f):
 
 def get_mentor(username):
     if username != current_user.username:
-        user = Mentor.query.filter_by(username=username).first_or_404()
-        if user.access_level >= current_user.access_level:
-            abort(404)
+        user = scope().mentors().filter(Mentor.username == username).first_or_404()
     else:
-        user = current_user
+        user = current_user.get_mentor()
 
     return user
 
 
 def get_student(student_id):
-    user = Student.query.filter_by(id=student_id).first_or_404()
+    user = scope().students().filter(Student.id == student_id).first_or_404()
     return user
 
 
 def get_group(group_id):
-    group = Group.query.filter_by(id=group_id).first_or_404()
+    group = scope().groups().filter(Group.id == group_id).first_or_404()
     return group
 
 
@@ -53,27 +52,28 @@ def is_admin(user):
 
 
 def get_discipline_records(student):
-    if current_user.access_level == Access.HAWK:
-        return None
-
-    discipline_records = student.discipline_records
-    if current_user.access_level in [Access.MENTOR, Access.UP_MENTOR]:
-        theme_ids = current_user.discipline.themes.with_entities(Theme.id)
-        discipline_records.filter(
-            DisciplinePointRecord.theme_id.in_(theme_ids))
+    return scope().discipline_records(student.discipline_records)
 
-    return discipline_records
 
+def chunks(items, size):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
 
-def get_vk_users_data(r_form):
 
+def parse_vk_ids(r_form):
     try:
         ids = [int(i) for i in r_form['id_list'].replace(',', ' ').split()]
     except ValueError:
-        None
+        return None
+    # Порядок сохраняем, повторы убираем
+    return list(dict.fromkeys(ids))
 
-    vk_session = vk_api.VkApi(token=app.config['VK_SERVICE_KEY'])
-    vk = vk_session.get_api()
 
-    users = vk.users.get(user_ids=ids, lang='ru')
+def get_vk_users_data(ids):
+    users = []
+    with service_session() as session:
+        vk = session.get_api()
+        for chunk in chunks(ids, app.config['VK_USERS_GET_LIMIT']):
+            users += vk.users.get(user_ids=chunk, lang='ru')
     return users
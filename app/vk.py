@@ -0,0 +1,128 @@
+import time
+import threading
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+import vk_api
+from app import app, db
+from app.models import VkGroup
+
+API_URL = 'https://api.vk.com/method/'
+
+
+class LocalApiAdapter(HTTPAdapter):
+    # Перенаправляет запросы к API на VK_API_URL (например, локальный тестовый сервер)
+    def __init__(self, base_url, *args, **kwargs):
+        super(LocalApiAdapter, self).__init__(*args, **kwargs)
+        self.base_url = base_url
+
+    def send(self, request, **kwargs):
+        request.url = self.base_url + request.url[len(API_URL):]
+        return super(LocalApiAdapter, self).send(request, **kwargs)
+
+
+# Сессии VK по токену на процесс: одно keep-alive соединение вместо TLS на каждый вызов.
+# VkApi держит свою блокировку на все время запроса, поэтому на токен заводится
+# несколько VkApi поверх общего requests.Session - по одному на одновременный вызов.
+class TokenSessions:
+    def __init__(self, token, http):
+        self.token = token
+        self.http = http
+        self.idle = []
+        self.in_use = 0
+        self.last_used = time.monotonic()
+        self.retired = False
+
+
+class SessionRegistry:
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def session(self, token):
+        with self._lock:
+            self._evict_idle(time.monotonic())
+            entry = self._sessions.get(token)
+            if entry is None:
+                entry = self._sessions[token] = TokenSessions(token, self._create_http())
+            entry.in_use += 1
+            vk = entry.idle.pop() if entry.idle else vk_api.VkApi(token=token, session=entry.http)
+        try:
+            yield vk
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+                if not entry.retired and len(entry.idle) < app.config['VK_SESSION_POOL_SIZE']:
+                    entry.idle.append(vk)
+                close = entry.retired and not entry.in_use
+            if close:
+                entry.http.close()
+
+    def invalidate(self, token):
+        with self._lock:
+            entry = self._sessions.pop(token, None)
+            close = entry is not None and self._retire(entry)
+        if close:
+            entry.http.close()
+
+    def clear(self):
+        with self._lock:
+            entries = [entry for entry in self._sessions.values() if self._retire(entry)]
+            self._sessions.clear()
+        for entry in entries:
+            entry.http.close()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @staticmethod
+    def _retire(entry):
+        # Соединение занятой сессии закроет последний вернувший ее вызов
+        entry.retired = True
+        entry.idle = []
+        return not entry.in_use
+
+    def _evict_idle(self, now):
+        timeout = app.config['VK_SESSION_IDLE_TIMEOUT']
+        for token, entry in list(self._sessions.items()):
+            if not entry.in_use and now - entry.last_used > timeout:
+                del self._sessions[token]
+                self._retire(entry)
+                entry.http.close()
+
+    @staticmethod
+    def _create_http():
+        http = requests.Session()
+        pool_size = app.config['VK_SESSION_POOL_SIZE']
+        if app.config['VK_API_URL']:
+            adapter = LocalApiAdapter(app.config['VK_API_URL'], pool_maxsize=pool_size)
+        else:
+            adapter = HTTPAdapter(pool_maxsize=pool_size)
+        http.mount(API_URL, adapter)
+        return http
+
+
+sessions = SessionRegistry()
+
+
+def vk_session(token):
+    # with vk_session(token) as vk: vk.method(...)
+    return sessions.session(token)
+
+
+def service_session():
+    return sessions.session(app.config['VK_SERVICE_KEY'])
+
+
+@db.event.listens_for(VkGroup.token, 'set', active_history=True)
+def token_changed(target, value, oldvalue, initiator):
+    if isinstance(oldvalue, str) and oldvalue != value:
+        sessions.invalidate(oldvalue)
+
+
+@db.event.listens_for(VkGroup, 'after_delete')
+def group_deleted(mapper, connection, target):
+    if target.token:
+        sessions.invalidate(target.token)
@@ -13,9 +13,74 @@ class Config(object):
     MENTORS_PER_PAGE = 20
     STUDENTS_PER_PAGE = 20
     RECORDS_PER_PAGE = 20
+    COMMUNITIES_PER_PAGE = 20
+
+    # Статистика запросов к базе по страницам, см. app/profiler.py
+    SQL_STATS = os.environ.get('SQL_STATS') == '1'
+    SQL_STATS_HISTORY = 50
+    SQL_STATS_SLOWEST = 5
+    # Столько одинаковых запросов за страницу считаем N+1
+    SQL_STATS_REPEAT_THRESHOLD = 10
+
+    # Запоминать запросы страниц для flask sql advise, см. app/advisor.py
+    SQL_ADVISOR = os.environ.get('SQL_ADVISOR')
+
+    # Кэш общего числа записей в списках: размер и время жизни в секундах
+    PAGINATION_COUNT_CACHE_SIZE = 1000
+    PAGINATION_COUNT_TTL = 60
+
+    # Кэш отрисованных карточек и строк таблиц
+    FRAGMENT_CACHE_SIZE = 5000
+    FRAGMENT_CACHE_TTL = 300
+
+    # JSON API: записей на страницу, наибольшая пачка ?ids= и ?limit=, срок токена в секундах
+    API_PER_PAGE = 50
+    API_BATCH_SIZE = 100
+    API_TOKEN_MAX_AGE = int(os.environ.get('API_TOKEN_MAX_AGE') or 90 * 24 * 3600)
+
+    # Кэш вариантов выпадающих списков (предметы, темы, подарки), сек.
+    CHOICE_CACHE_SIZE = 100
+    CHOICE_CACHE_TTL = 300
+    # Групп на одну страницу подсказок
+    TYPEAHEAD_PER_PAGE = 20
+
+    # Кэш данных вошедших менторов, сек.
+    MENTOR_CACHE_SIZE = 1000
+    MENTOR_CACHE_TTL = 60
+
+    # Хэширование паролей: pbkdf2 или bcrypt, стоимость подбирать по flask password benchmark
+    PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER') or 'pbkdf2'
+    PBKDF2_ITERATIONS = int(os.environ.get('PBKDF2_ITERATIONS') or 150000)
+    BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS') or 12)
 
     REFER_RECORD_POINTS = 100
 
+    # Размер пачки для запросов с IN (...) при массовых операциях
+    BULK_CHUNK_SIZE = 500
+    # Строк за одно чтение из базы и одну отправку при выгрузке в CSV
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE') or 1000)
+
     BOT_URL = "https://bonus-point-site.herokuapp.com/communities/bot"
 
     VK_SERVICE_KEY = '436dda3f436dda3f436dda3f9c431dc2a74436d436dda3f1d0d98e3aee65cafefd50e11'
+
+    # Максимум id в одном запросе users.get
+    VK_USERS_GET_LIMIT = 1000
+
+    # Для тестов против локального сервера, например http://127.0.0.1:8000/method/
+    VK_API_URL = os.environ.get('VK_API_URL')
+
+    # Сессии VK API: закрывать неиспользуемые дольше, сек.
+    VK_SESSION_IDLE_TIMEOUT = 600
+    # Соединений и свободных VkApi на токен
+    VK_SESSION_POOL_SIZE = 10
+
+    # Очередь исходящих сообщений бота
+    VK_SEND_WORKERS = int(os.environ.get('VK_SEND_WORKERS') or 4)
+    VK_COMMUNITY_CONCURRENCY = int(os.environ.get('VK_COMMUNITY_CONCURRENCY') or 2)
+    VK_SEND_MAX_ATTEMPTS = 5
+    VK_SEND_LEASE = 60
+
+    # Повторные доставки событий VK: кэш на процесс, остальное - в таблице processed_event
+    VK_EVENT_CACHE_SIZE = 10000
+    VK_EVENT_CACHE_TTL = 600
@@ -0,0 +1,54 @@
+"""Поиск студентов
+
+Revision ID: 3a9c5e7f1b24
+Revises: e2a4f6b8c0d1
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a9c5e7f1b24'
+down_revision = 'e2a4f6b8c0d1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_student_name', 'student', ['last_name', 'first_name'], unique=False)
+
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE student_search USING fts5("
+                   "last_name, first_name, content='student', content_rowid='id', tokenize='trigram')")
+        op.execute("CREATE TRIGGER student_search_ai AFTER INSERT ON student BEGIN "
+                   "INSERT INTO student_search(rowid, last_name, first_name) "
+                   "VALUES (new.id, new.last_name, new.first_name); END")
+        op.execute("CREATE TRIGGER student_search_ad AFTER DELETE ON student BEGIN "
+                   "INSERT INTO student_search(student_search, rowid, last_name, first_name) "
+                   "VALUES ('delete', old.id, old.last_name, old.first_name); END")
+        op.execute("CREATE TRIGGER student_search_au AFTER UPDATE ON student BEGIN "
+                   "INSERT INTO student_search(student_search, rowid, last_name, first_name) "
+                   "VALUES ('delete', old.id, old.last_name, old.first_name); "
+                   "INSERT INTO student_search(rowid, last_name, first_name) "
+                   "VALUES (new.id, new.last_name, new.first_name); END")
+        op.execute("INSERT INTO student_search(student_search) VALUES ('rebuild')")
+    elif dialect == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute("CREATE INDEX ix_student_name_trgm ON student USING gin "
+                   "((lower(coalesce(last_name, '') || ' ' || coalesce(first_name, ''))) gin_trgm_ops)")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("DROP TRIGGER student_search_au")
+        op.execute("DROP TRIGGER student_search_ad")
+        op.execute("DROP TRIGGER student_search_ai")
+        op.execute("DROP TABLE student_search")
+    elif dialect == 'postgresql':
+        op.execute("DROP INDEX ix_student_name_trgm")
+
+    op.drop_index('ix_student_name', table_name='student')
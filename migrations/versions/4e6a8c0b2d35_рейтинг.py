@@ -0,0 +1,34 @@
+"""Рейтинг
+
+Revision ID: 4e6a8c0b2d35
+Revises: a1c3e5f7b9d2
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e6a8c0b2d35'
+down_revision = 'a1c3e5f7b9d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('student_balance', sa.Column('total', sa.Integer(), nullable=False, server_default='0'))
+    op.execute('UPDATE student_balance SET total = discipline_points + refer_points - spent_points')
+    # Строка создавалась только при первой записи, в рейтинге нужны все студенты
+    op.execute(
+        'INSERT INTO student_balance (student_id, discipline_points, refer_points, spent_points, total) '
+        'SELECT s.id, 0, 0, 0, 0 FROM student s '
+        'WHERE NOT EXISTS (SELECT 1 FROM student_balance b WHERE b.student_id = s.id)'
+    )
+    op.create_index(op.f('ix_student_balance_total'), 'student_balance', ['total'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_student_balance_total'), table_name='student_balance')
+    with op.batch_alter_table('student_balance') as batch_op:
+        batch_op.drop_column('total')
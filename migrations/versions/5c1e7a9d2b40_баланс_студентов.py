@@ -0,0 +1,39 @@
+"""Баланс студентов
+
+Revision ID: 5c1e7a9d2b40
+Revises: b8439f7c5f6f
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e7a9d2b40'
+down_revision = 'b8439f7c5f6f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('student_balance',
+    sa.Column('student_id', sa.Integer(), nullable=False),
+    sa.Column('discipline_points', sa.Integer(), nullable=False),
+    sa.Column('refer_points', sa.Integer(), nullable=False),
+    sa.Column('spent_points', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['student_id'], ['student.id'], ),
+    sa.PrimaryKeyConstraint('student_id')
+    )
+    op.execute(
+        'INSERT INTO student_balance (student_id, discipline_points, refer_points, spent_points) '
+        'SELECT s.id, '
+        'COALESCE((SELECT SUM(amount) FROM discipline_point_record WHERE student_id = s.id), 0), '
+        'COALESCE((SELECT SUM(amount) FROM refer_point_record WHERE student_id = s.id), 0), '
+        'COALESCE((SELECT SUM(cost) FROM order_record WHERE student_id = s.id), 0) '
+        'FROM student s'
+    )
+
+
+def downgrade():
+    op.drop_table('student_balance')
@@ -0,0 +1,34 @@
+"""Прогресс загрузки старых записей
+
+Revision ID: 6b2d4f8a0c13
+Revises: 4e6a8c0b2d35
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6b2d4f8a0c13'
+down_revision = '4e6a8c0b2d35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('import_progress',
+    sa.Column('name', sa.String(length=512), nullable=False),
+    sa.Column('kind', sa.String(length=16), nullable=True),
+    sa.Column('rows', sa.Integer(), nullable=False),
+    sa.Column('imported', sa.Integer(), nullable=False),
+    sa.Column('skipped', sa.Integer(), nullable=False),
+    sa.Column('errors', sa.Integer(), nullable=False),
+    sa.Column('done', sa.Boolean(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('import_progress')
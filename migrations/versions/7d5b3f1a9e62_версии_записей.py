@@ -0,0 +1,30 @@
+"""Версии записей
+
+Revision ID: 7d5b3f1a9e62
+Revises: 3a9c5e7f1b24
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d5b3f1a9e62'
+down_revision = '3a9c5e7f1b24'
+branch_labels = None
+depends_on = None
+
+tables = ['mentor', 'student', 'group', 'discipline', 'discipline_point_record',
+          'refer_point_record', 'vk_group', 'order_record', 'order']
+
+
+def upgrade():
+    for table in tables:
+        op.add_column(table, sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    for table in tables:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('version')
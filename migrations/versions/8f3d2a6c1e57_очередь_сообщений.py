@@ -0,0 +1,41 @@
+"""Очередь сообщений
+
+Revision ID: 8f3d2a6c1e57
+Revises: 5c1e7a9d2b40
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f3d2a6c1e57'
+down_revision = '5c1e7a9d2b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('outbound_message',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('peer_id', sa.Integer(), nullable=True),
+    sa.Column('message', sa.String(length=4096), nullable=True),
+    sa.Column('random_id', sa.Integer(), nullable=True),
+    sa.Column('status_id', sa.Integer(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=True),
+    sa.Column('next_attempt', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.String(length=256), nullable=True),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.Column('vk_group_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['vk_group_id'], ['vk_group.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outbound_message_status_next', 'outbound_message', ['status_id', 'next_attempt'], unique=False)
+    op.create_index(op.f('ix_outbound_message_vk_group_id'), 'outbound_message', ['vk_group_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_outbound_message_vk_group_id'), table_name='outbound_message')
+    op.drop_index('ix_outbound_message_status_next', table_name='outbound_message')
+    op.drop_table('outbound_message')
@@ -0,0 +1,78 @@
+"""Индексы
+
+Revision ID: a1c3e5f7b9d2
+Revises: 7d5b3f1a9e62
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1c3e5f7b9d2'
+down_revision = '7d5b3f1a9e62'
+branch_labels = None
+depends_on = None
+
+# Таблицы связей: (таблица, столбцы, первичный ключ, обратный индекс)
+association = [
+    ('group_students', ['student_id', 'group_id'], ['group_id', 'student_id'], ['student_id', 'group_id']),
+    ('group_mentors', ['group_id', 'mentor_id'], ['group_id', 'mentor_id'], ['mentor_id', 'group_id']),
+]
+
+foreign = {
+    'group_id': 'group.id',
+    'student_id': 'student.id',
+    'mentor_id': 'mentor.id'
+}
+
+
+def rebuild(table, columns, primary_key=None):
+    # Ключ нельзя добавить к таблице с повторами, поэтому копируем без них
+    op.create_table(table + '_tmp',
+                    *[sa.Column(c, sa.Integer(), nullable=primary_key is None) for c in columns],
+                    *[sa.ForeignKeyConstraint([c], [foreign[c]]) for c in columns],
+                    *([sa.PrimaryKeyConstraint(*primary_key)] if primary_key else []))
+    names = ', '.join(columns)
+    op.execute('INSERT INTO %s_tmp (%s) SELECT DISTINCT %s FROM %s WHERE %s' % (
+        table, names, names, table, ' AND '.join(c + ' IS NOT NULL' for c in columns)))
+    op.drop_table(table)
+    op.rename_table(table + '_tmp', table)
+
+    # В Postgres имена ограничений остаются от временной таблицы
+    if op.get_bind().dialect.name == 'postgresql':
+        suffixes = ['%s_fkey' % c for c in columns] + (['pkey'] if primary_key else [])
+        for suffix in suffixes:
+            op.execute('ALTER TABLE %s RENAME CONSTRAINT %s_tmp_%s TO %s_%s' % (
+                table, table, suffix, table, suffix))
+
+
+def upgrade():
+    for table, columns, primary_key, reverse in association:
+        rebuild(table, columns, primary_key)
+        op.create_index('ix_%s_%s' % (table, reverse[0]), table, reverse, unique=False)
+
+    op.create_index(op.f('ix_refer_point_record_student_id'), 'refer_point_record', ['student_id'], unique=False)
+    op.create_index(op.f('ix_theme_discipline_id'), 'theme', ['discipline_id'], unique=False)
+    op.create_index(op.f('ix_group_discipline_id'), 'group', ['discipline_id'], unique=False)
+    op.create_index(op.f('ix_mentor_discipline_id'), 'mentor', ['discipline_id'], unique=False)
+
+    # Списки заказов по подарку и статусу, упорядоченные по времени
+    op.drop_index('ix_order_record_order_id', table_name='order_record')
+    op.create_index('ix_order_record_order_status', 'order_record',
+                    ['order_id', 'status_id', 'timestamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_order_record_order_status', table_name='order_record')
+    op.create_index('ix_order_record_order_id', 'order_record', ['order_id'], unique=False)
+
+    op.drop_index(op.f('ix_mentor_discipline_id'), table_name='mentor')
+    op.drop_index(op.f('ix_group_discipline_id'), table_name='group')
+    op.drop_index(op.f('ix_theme_discipline_id'), table_name='theme')
+    op.drop_index(op.f('ix_refer_point_record_student_id'), table_name='refer_point_record')
+
+    for table, columns, primary_key, reverse in association:
+        op.drop_index('ix_%s_%s' % (table, reverse[0]), table_name=table)
+        rebuild(table, columns)
@@ -0,0 +1,31 @@
+"""События сообществ
+
+Revision ID: c47b19e0d3a8
+Revises: 8f3d2a6c1e57
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47b19e0d3a8'
+down_revision = '8f3d2a6c1e57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('processed_event',
+    sa.Column('vk_group_id', sa.Integer(), nullable=False),
+    sa.Column('event_id', sa.String(length=64), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('vk_group_id', 'event_id')
+    )
+    op.create_index(op.f('ix_processed_event_timestamp'), 'processed_event', ['timestamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_processed_event_timestamp'), table_name='processed_event')
+    op.drop_table('processed_event')
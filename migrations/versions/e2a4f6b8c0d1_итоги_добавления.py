@@ -0,0 +1,33 @@
+"""Итоги добавления студентов
+
+Revision ID: e2a4f6b8c0d1
+Revises: c47b19e0d3a8
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a4f6b8c0d1'
+down_revision = 'c47b19e0d3a8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('import_report',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.Column('details', sa.Text(), nullable=True),
+    sa.Column('mentor_id', sa.Integer(), nullable=True),
+    sa.Column('group_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['group_id'], ['group.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['mentor_id'], ['mentor.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('import_report')